@@ -16,14 +16,18 @@
 # this code re-uses parts of Kai Zhang's code for other experiments in our group
 # and is still being worked on to make it complete with the new pulse sequences introduced by Gurudev Dutt
 
-from ftplib import FTP
-import socket,sys, struct
+from ftplib import FTP, all_errors, error_perm
+import fnmatch
+import json
+import socket,select,sys,mmap,os,hashlib,time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from pathlib import Path
 import logging
 # from Pulse import Gaussian,Sech,Square,Marker
 from .Sequence import Sequence, SequenceList
-import time
+from .Profiler import profiler
+from ..LogFiles import add_log_handlers
 
 _DAC_BITS = 10
 _IP_ADDRESS = '172.17.39.2' # comment out for testing
@@ -31,6 +35,8 @@ _IP_ADDRESS = '172.17.39.2' # comment out for testing
 _PORT = 4000 # comment out for testing
 #_PORT = 65432 #switch ports for loopback
 _FTP_PORT = 21 # 63217 use this for teting
+_CONNECT_TIMEOUT = 5.0 # seconds to wait for the AWG to accept the connection
+_READ_TIMEOUT = 10.0 # seconds to wait for the reply to a query
 _MW_S1 = 'S1' #disconnected for now
 _MW_S2 = 'S2'#channel 1, marker 1
 _GREEN_AOM = 'Green' # ch1, marker 2
@@ -40,30 +46,45 @@ _DAC_UPPER = 1024.0 # DAC has only 1024 levels
 _DAC_MID = 512
 _WFM_MEMORY_LIMIT = 1048512 # at most this many points can be in a waveform
 _SEQ_MEMORY_LIMIT = 8000
+_AWG_MEMORY_LIMIT = 4194304 # points of waveform memory per channel, shared by all the waveforms of a loaded sequence
+_SEQ_REPEAT_LIMIT = 65536 # largest repeat count of a line in a seq file
+_RLE_BLOCK = 256 # shortest waveform the AWG520 plays, compressed steps look for runs of blocks of this many points
+_RLE_MIN_REPEAT = 4 # shorter runs of identical blocks are not worth the extra lines in the seq file
 _IQTYPE = np.dtype('<f4') # AWG520 stores analog values as 4 bytes in little-endian format
 _MARKTYPE = np.dtype('<i1') # AWG520 stores marker values as 1 byte
+# one record of the wfm body: 4 byte analog value followed by 1 byte of marker data, numpy packs this to 5 bytes
+_WFMTYPE = np.dtype([('iq', _IQTYPE), ('marker', _MARKTYPE)])
 
 privatelogger = logging.getLogger('awg520private')
 dirpath = Path('.') /'sequencefiles'
-privatelogger.setLevel(logging.DEBUG)
+# hashes of the files that are on the AWG, so that unchanged files are not uploaded again
+manifestpath = dirpath / 'awg520manifest.json'
 logfilepath = Path('.')/'logs'
-# create a file handler that logs even debug messages
-fh = logging.FileHandler((logfilepath / 'awg520private.log').resolve())
-fh.setLevel(logging.DEBUG)
-# create a console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.ERROR)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-ch.setFormatter(formatter)
-# add the handlers to the logger
-privatelogger.addHandler(fh)
-privatelogger.addHandler(ch)
+# the log file is only opened when the first message is logged
+add_log_handlers(privatelogger, logfilepath / 'awg520private.log')
 
 class AWG520(object):
-    def __init__(self,ip_address=_IP_ADDRESS,port=_PORT):
+    def __init__(self,ip_address=_IP_ADDRESS,port=_PORT,connecttimeout=_CONNECT_TIMEOUT,readtimeout=_READ_TIMEOUT,
+                 ftpport=_FTP_PORT,manifestpath=manifestpath):
+        """Class that sends SCPI commands to the AWG520 over a single TCP connection, which is opened by the first
+        command and kept open, and transfers files to it over a single FTP session. Args are:
+        1. ip_address, port: address of the AWG
+        2. connecttimeout: seconds to wait for the connection to be made
+        3. readtimeout: seconds to wait for the reply to a query
+        4. ftpport: port of the FTP server of the AWG
+        5. manifestpath: JSON file with the hash and size of each file uploaded to the AWG, see syncfiles. If it is None
+        the hashes are only kept for the life of this instance.
+        If the connection or the FTP session is lost it is made again once, on the next command or file.
+        """
         self.addr=(ip_address,port)
+        self.ftpport = ftpport
+        self.manifestpath = manifestpath
+        self.manifest = None
+        self.connecttimeout = connecttimeout
+        self.readtimeout = readtimeout
+        self.mysocket = None
+        self.reader = None
+        self.myftp = None
         self.logger = logging.getLogger('awg520private.awg520cls')
         #logging.basicConfig(format='%(asctime)s %(message)s')
         self.logger.info("Initializing AWG instance...")
@@ -71,52 +92,129 @@ class AWG520(object):
         print('AWG model = %s', self.sendcommand('*IDN?'))
         # USR:4.0\n'
         
+    def connect(self):
+        """opens the connection to the AWG, replies are read through a buffered reader on the socket"""
+        self.mysocket = socket.create_connection(self.addr, timeout=self.connecttimeout)
+        self.mysocket.settimeout(self.readtimeout)
+        # the commands are short and each one is waited on, so don't hold them back to fill a packet
+        self.mysocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.mysocket.makefile('rb')
+        self.logger.info('Connected to AWG at %s:%d', *self.addr)
+
+    def connected(self):
+        """returns False if the AWG has closed the connection. An open connection with nothing to read is not
+        readable, while a closed one reads as empty"""
+        if self.mysocket is None:
+            return False
+        readable, writable, failed = select.select([self.mysocket], [], [], 0)
+        return not readable or self.mysocket.recv(1, socket.MSG_PEEK) != b''
+
+    def disconnect(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.mysocket is not None:
+            self.mysocket.close()
+            self.mysocket = None
+
     def sendcommand(self,command):
         query='?' in command
         if not command.endswith('\n'):
             command+='\n'
-        try:
-            self.logger.info('Sending AWG command: %s',command)
-            with socket.socket(socket.AF_INET,socket.SOCK_STREAM) as self.mysocket:
-                self.mysocket.connect(self.addr)
+        self.logger.info('Sending AWG command: %s',command)
+        for attempt in range(2):
+            try:
+                if not self.connected():
+                    self.disconnect()
+                    self.connect()
                 self.mysocket.sendall(command.encode()) # check if this works with real AWG later
                 # TODO: AWG status checking should go here in future
-                if query:
-                    reply=b''
-                    while not reply.endswith(b'\n'):
-                        reply+=self.mysocket.recv(1024)
-                        self.logger.info('waiting for AWG reply')
-                    self.logger.info("Received AWG reply: %s", reply.decode())
-                    return reply.decode()
-                else:
+                if not query:
                     return None
-        except IOError as error:
-            #sys.stderr.write(sys.exc_info())
-            #sys.stderr.write(error.message+'\n')
-            self.logger.error(sys.exc_info())
-            self.logger.error("OS Error:{0}".format(error))
-            return None
+                reply = self.reader.readline()
+                if not reply.endswith(b'\n'):
+                    raise ConnectionError('AWG closed the connection before replying')
+                self.logger.info("Received AWG reply: %s", reply.decode())
+                return reply.decode()
+            except socket.timeout as error:
+                # a late reply would be read as the reply of the next query, so start again on a new connection
+                self.disconnect()
+                self.logger.error("Timed out waiting for the AWG:{0}".format(error))
+                return None
+            except IOError as error:
+                #sys.stderr.write(sys.exc_info())
+                #sys.stderr.write(error.message+'\n')
+                self.disconnect()
+                if attempt == 0:
+                    self.logger.info('Lost the connection to the AWG, reconnecting: {0}'.format(error))
+                    continue
+                self.logger.error(sys.exc_info())
+                self.logger.error("OS Error:{0}".format(error))
+                return None
 
-    def sendfile(self,fileRemote,fileLocal):
-        self.myftp = FTP('')
-        self.myftp.connect(self.addr[0]) # TODO: will need to check FTP port on AWG
+    def ftp_connect(self):
+        """opens the FTP session used for all the files sent to the AWG"""
+        self.myftp = FTP()
+        self.myftp.connect(self.addr[0], self.ftpport, timeout=self.connecttimeout)
         self.myftp.login('usr', 'pw')  # user name and password, these can be anything; no real login
-        try:
-            strIt='STOR ' + str(fileRemote)
-            self.logger.info('Sending file %s to %s',fileLocal,fileRemote)
-            t = time.process_time()
-            self.myftp.storbinary(strIt, open(fileLocal,'rb')) #store file on awg
-            elapsed_time = time.process_time() - t
-            self.logger.info("Elapsed time in transferring file is {0:6f} secs".format(elapsed_time))
-            self.myftp.close()
-            return 0
-        except IOError as err:
-            #sys.stderr.write(str(sys.exc_info()[0]))
-            #sys.stderr.write(str(sys.exc_info()[1]))
-            #sys.stderr.write(e.message+'\n')
-            self.logger.error(sys.exc_info())
-            self.logger.error("OS Error:{0}".format(err))
-            return -1
+        self.myftp.voidcmd('TYPE I')  # SIZE is only defined for binary transfers
+        self.logger.info('Opened FTP session to AWG at %s:%d', self.addr[0], self.ftpport)
+
+    def ftp_close(self):
+        if self.myftp is not None:
+            try:
+                self.myftp.quit()
+            except all_errors:
+                self.myftp.close()
+            self.myftp = None
+
+    def sendfile(self,fileRemote,fileLocal):
+        """sends the local file to the AWG through the FTP session, which is opened if needed and opened again once if
+        it fails. fileLocal can also be a buffer holding the encoded file, such as the buffers of an in memory AWGFile,
+        which is then sent without a copy. Returns the number of bytes sent, or -1 if the file could not be sent"""
+        strIt='STOR ' + str(fileRemote)
+        self.logger.info('Sending file %s to %s',fileLocal,fileRemote)
+        for attempt in range(2):
+            try:
+                if self.myftp is None:
+                    self.ftp_connect()
+                with profiler.span('transfer') as span, open_local(fileLocal) as lfile:
+                    self.myftp.storbinary(strIt, lfile) #store file on awg
+                    nbytes = lfile.tell()
+                    span.add_bytes(nbytes)
+                return nbytes
+            except all_errors as err:
+                #sys.stderr.write(str(sys.exc_info()[0]))
+                #sys.stderr.write(str(sys.exc_info()[1]))
+                #sys.stderr.write(e.message+'\n')
+                self.ftp_close()
+                if attempt == 0 and not isinstance(err, FileNotFoundError):
+                    self.logger.info('FTP session to AWG failed, reconnecting: {0}'.format(err))
+                    continue
+                self.logger.error(sys.exc_info())
+                self.logger.error("OS Error:{0}".format(err))
+                return -1
+
+    def sendfiles(self, files):
+        """sends all the files of a scan through one FTP session, with args:
+        1. files: list of (remote file name, local file path or buffer), e.g. list(awgfile.buffers.items())
+        Logs the throughput of each file and of all of them, and returns the total number of bytes sent, or -1 if any
+        file could not be sent"""
+        total = 0
+        t = time.perf_counter()
+        for (fileRemote, fileLocal) in files:
+            tfile = time.perf_counter()
+            nbytes = self.sendfile(fileRemote, fileLocal)
+            if nbytes < 0:
+                return -1
+            elapsed = time.perf_counter() - tfile
+            self.logger.info('Sent {0} bytes in {1:.4f} s, {2:.3f} MB/s'.format(nbytes, elapsed,
+                                                                             nbytes / max(elapsed, 1e-9) / 1e6))
+            total += nbytes
+        elapsed = time.perf_counter() - t
+        self.logger.info('Sent {0} files, {1} bytes in {2:.3f} s, {3:.3f} MB/s'.format(
+            len(files), total, elapsed, total / max(elapsed, 1e-9) / 1e6))
+        return total
 
     def set_clock_external(self):
         self.sendcommand('AWGC:CLOC:SOUR EXT')
@@ -133,45 +231,50 @@ class AWG520(object):
     def jump(self, line):
         self.sendcommand('AWGC:EVEN:SOFT ' + str(line) + '\n')
 
+    def sendcommands(self, commands, queries=('*OPC?',)):
+        """sends the commands in one write as a single line joined by semicolons, with the queries at the end, and
+        returns the replies of the queries as a list, or None if the AWG did not reply. The commands are run in order,
+        so *OPC? replies once all of them are done and SYST:ERR? returns the first error they caused."""
+        commands = [command.strip() for command in list(commands) + list(queries)]
+        # a leading colon takes each command back to the root of the command tree, the * commands have no tree
+        line = ';'.join(command if command.startswith(('*', ':')) else ':' + command for command in commands)
+        reply = self.sendcommand(line)
+        if reply is None or not queries:
+            return None
+        return reply.strip().split(';', len(queries) - 1)
+
     def setup(self,enableiq=False):
+        """sets up the clock, sequence, voltages and outputs of the AWG in one round trip, and returns True if the AWG
+        reported no errors"""
         self.logger.info('Setting up AWG...')
-
-        self.set_clock_external()
-        # load seq
-        self.sendcommand('SOUR1:FUNC:USER "scan.seq","MAIN"\n')
-        self.sendcommand('SOUR2:FUNC:USER "scan.seq","MAIN"\n')
-
-        # set up voltages
-        # mysocket.sendall('SOUR2:VOLT:AMPL 2000mV\n')
-        # mysocket.sendall('SOUR2:VOLT:OFFS 1000mV\n')
-        # '''edited on 8/6/2019 for use w/ IQ modulator: max Vpp = 1.0'''
-        # mysocket.sendall('SOUR1:MARK1:VOLT:LOW 0\n')
-        # mysocket.sendall('SOUR1:MARK1:VOLT:HIGH 1.9\n')
-        # mysocket.sendall('SOUR1:MARK2:VOLT:LOW 0\n')
-        # mysocket.sendall('SOUR1:MARK2:VOLT:HIGH 2.0\n')
-        # mysocket.sendall('SOUR2:MARK1:VOLT:LOW 0\n')
-        # mysocket.sendall('SOUR2:MARK1:VOLT:HIGH 2.0\n')
-        # mysocket.sendall('SOUR2:MARK2:VOLT:LOW 0\n')
-        # mysocket.sendall('SOUR2:MARK2:VOLT:HIGH 2.0\n')
-        self.sendcommand('SOUR2:VOLT:AMPL 2000mV\n')
-        self.sendcommand('SOUR2:VOLT:OFFS 1000mV\n')
-        '''edited on 8/6/2019 for use w/ IQ modulator: max Vpp = 1.0'''
-        self.sendcommand('SOUR1:MARK1:VOLT:LOW 0\n')
-        self.sendcommand('SOUR1:MARK1:VOLT:HIGH 1.9\n')
-        self.sendcommand('SOUR1:MARK2:VOLT:LOW 0\n')
-        self.sendcommand('SOUR1:MARK2:VOLT:HIGH 2.0\n')
-        self.sendcommand('SOUR2:MARK1:VOLT:LOW 0\n')
-        self.sendcommand('SOUR2:MARK1:VOLT:HIGH 2.0\n')
-        self.sendcommand('SOUR2:MARK2:VOLT:LOW 0\n')
-        self.sendcommand('SOUR2:MARK2:VOLT:HIGH 2.0\n')
-
-        # turn on channels
+        commands = ['AWGC:CLOC:SOUR EXT',
+                    # load seq
+                    'SOUR1:FUNC:USER "scan.seq","MAIN"',
+                    'SOUR2:FUNC:USER "scan.seq","MAIN"',
+                    # set up voltages
+                    'SOUR2:VOLT:AMPL 2000mV',
+                    'SOUR2:VOLT:OFFS 1000mV',
+                    # edited on 8/6/2019 for use w/ IQ modulator: max Vpp = 1.0
+                    'SOUR1:MARK1:VOLT:LOW 0',
+                    'SOUR1:MARK1:VOLT:HIGH 1.9',
+                    'SOUR1:MARK2:VOLT:LOW 0',
+                    'SOUR1:MARK2:VOLT:HIGH 2.0',
+                    'SOUR2:MARK1:VOLT:LOW 0',
+                    'SOUR2:MARK1:VOLT:HIGH 2.0',
+                    'SOUR2:MARK2:VOLT:LOW 0',
+                    'SOUR2:MARK2:VOLT:HIGH 2.0',
+                    # turn on channels
+                    'OUTP1:STAT ON']
         if enableiq:
-            self.sendcommand('OUTP1:STAT ON\n')
-            self.sendcommand('OUTP2:STAT ON\n')
-        else:
-            self.sendcommand('OUTP1:STAT ON\n')
-
+            commands.append('OUTP2:STAT ON')
+        replies = self.sendcommands(commands, queries=('*OPC?', 'SYST:ERR?'))
+        if replies is None or len(replies) != 2:
+            self.logger.error('AWG did not confirm the setup, reply was {0}'.format(replies))
+            return False
+        if not replies[1].startswith('0'):
+            self.logger.error('AWG setup failed with error {0}'.format(replies[1]))
+            return False
+        return True
 
     def run(self):
         self.sendcommand('AWGC:RUN\n')  # runs a sequence in enhanced mode
@@ -194,8 +297,8 @@ class AWG520(object):
 
     # cleanup the connections
     def cleanup(self):
-        self.mysocket.close()
-        self.myftp.close()
+        self.disconnect()
+        self.ftp_close()
     # functions that can help with error checking and remote file manipulation
     def status(self):
         # TODO: this needs to be written referring to section 3-1 of the AWG520 programmer manual
@@ -204,17 +307,132 @@ class AWG520(object):
     def error_check(self):
         pass
 
+    def ftpcall(self, name, *args):
+        """calls the FTP method name with args on the session, which is opened if needed and opened again once if it
+        fails. Permanent errors of the FTP server, such as a missing file, are raised at once"""
+        for attempt in range(2):
+            try:
+                if self.myftp is None:
+                    self.ftp_connect()
+                return getattr(self.myftp, name)(*args)
+            except error_perm:
+                raise
+            except all_errors as err:
+                self.ftp_close()
+                if attempt == 0:
+                    self.logger.info('FTP session to AWG failed, reconnecting: {0}'.format(err))
+                    continue
+                raise
+
     def list_awg_files(self):
-        pass
+        """returns the names of the files on the AWG, or None if they could not be listed"""
+        try:
+            return [name.rsplit('/', 1)[-1] for name in self.ftpcall('nlst')]
+        except error_perm as err:
+            if str(err).startswith('550'):
+                return []  # some servers answer an empty directory with 550 no files found
+            self.logger.error("FTP Error:{0}".format(err))
+            return None
+        except all_errors as err:
+            self.logger.error("FTP Error:{0}".format(err))
+            return None
+
+    def awg_file_size(self, filename):
+        """returns the size in bytes of a file on the AWG, or None if it does not exist"""
+        try:
+            return self.ftpcall('size', filename)
+        except all_errors as err:
+            self.logger.info('Could not get the size of {0} on the AWG: {1}'.format(filename, err))
+            return None
 
     def remove_awg_file(self,filename):
-        pass
+        """removes a file from the AWG, returns True if it was removed"""
+        try:
+            self.ftpcall('delete', filename)
+        except all_errors as err:
+            self.logger.error("Could not remove {0} from the AWG:{1}".format(filename, err))
+            return False
+        self.logger.info('Removed %s from the AWG', filename)
+        if self.manifest is not None:
+            self.manifest.pop(filename, None)
+        return True
 
     def remove_all_awg_files(self):
-        pass
+        """removes all the files from the AWG, returns the names of the files removed"""
+        return self.remove_selected_awg_files('*')
 
     def remove_selected_awg_files(self, pattern):
-        pass
+        """removes the files on the AWG whose names match the shell pattern, e.g. *.wfm, and returns their names"""
+        names = self.list_awg_files() or []
+        return [name for name in names if fnmatch.fnmatch(name, pattern) and self.remove_awg_file(name)]
+
+    def load_manifest(self):
+        """returns the {file name: [hash, size]} of the files uploaded to this AWG, read from the manifest file the
+        first time"""
+        if self.manifest is None:
+            self.manifest = {}
+            if self.manifestpath is not None and os.path.exists(self.manifestpath):
+                try:
+                    with open(self.manifestpath) as f:
+                        self.manifest = json.load(f).get(self.addr[0], {})
+                except (IOError, ValueError) as err:
+                    self.logger.error('Could not read the AWG manifest, all files will be uploaded: {0}'.format(err))
+        return self.manifest
+
+    def save_manifest(self):
+        if self.manifestpath is None:
+            return
+        try:
+            manifests = {}
+            if os.path.exists(self.manifestpath):
+                with open(self.manifestpath) as f:
+                    manifests = json.load(f)
+            manifests[self.addr[0]] = self.manifest
+            os.makedirs(os.path.dirname(os.path.abspath(self.manifestpath)), exist_ok=True)
+            with open(self.manifestpath, 'w') as f:
+                json.dump(manifests, f, indent=1, sort_keys=True)
+        except (IOError, ValueError) as err:
+            self.logger.error('Could not write the AWG manifest: {0}'.format(err))
+
+    def syncfiles(self, files, prune=True):
+        """uploads only the files whose content is not on the AWG yet, with args:
+        1. files: list of (remote file name, local file path or buffer), the same as for sendfiles
+        2. prune: if True the wfm files on the AWG that are not in files are removed, so the AWG does not have to
+        load them
+        A file is skipped when the manifest has the same hash for it and the AWG has a file of that name and size.
+        If the files on the AWG cannot be listed all of them are sent. Returns the number of bytes sent, or -1 if any
+        file could not be sent"""
+        manifest = self.load_manifest()
+        remote = self.list_awg_files()
+        if remote is None:
+            manifest.clear()
+            remote = []
+        remote = set(remote)
+        # forget the files that are no longer on the AWG
+        for name in set(manifest) - remote:
+            del manifest[name]
+        changed = []
+        entries = {}
+        for (fileRemote, fileLocal) in files:
+            with open_local(fileLocal) as lfile:
+                data = lfile.read()
+                entry = [file_digest(data), len(data)]
+            if manifest.get(fileRemote) == entry and self.awg_file_size(fileRemote) == entry[1]:
+                continue
+            changed.append((fileRemote, fileLocal))
+            entries[fileRemote] = entry
+            manifest.pop(fileRemote, None)
+        self.logger.info('{0} of {1} files changed since the last upload'.format(len(changed), len(files)))
+        nbytes = self.sendfiles(changed)
+        if nbytes >= 0:
+            manifest.update(entries)
+            if prune:
+                wanted = set(fileRemote for (fileRemote, fileLocal) in files)
+                for name in sorted(remote - wanted):
+                    if name.endswith('.wfm'):
+                        self.remove_awg_file(name)
+        self.save_manifest()
+        return nbytes
 
     def get_awg_ftp_status(self):
         pass
@@ -262,32 +480,47 @@ here <chX_filename> is the wfm file name for the specified channel x (which can
          """
 
 class AWGFile(object):
-    def __init__(self,sequence = None,sequencelist = None,ftype='WFM',timeres=1,dirpath=dirpath):
+    def __init__(self,sequence = None,sequencelist = None,ftype='WFM',timeres=1,dirpath=dirpath,writemode='buffered',
+                 workers=None,stream=False,compress=False,inmemory=False):
         """This class will create and write files of sequences and sequencelists to the default sequencfiles
         directory specified. Args are:
         1. sequence: an object of Sequence type. If you don't specify any, a default sequence is used.
         2. sequencelist: an object of Sequencelist type. If you don't specify any, a default seqlist is used
         3. ftype: can be either WFM or SEQ indicating which one you want to write
         4. timeres: clock rate in ns.
+        5. writemode: can be either buffered or mmap. In mmap mode the wfm file is sized up front and memory mapped,
+        and the I/Q and marker data are copied straight into the mapped records without building the file in memory.
+        6. workers: number of processes used to compile and write the steps of a SEQ file in parallel. With more than
+        one worker the steps are not compiled here, each worker compiles its steps when write_sequence is called.
+        7. stream: if True the steps of a SEQ file are not compiled here, write_sequence compiles them one at a time
+        and frees each step once its files are written, so the memory used does not grow with the number of steps.
+        8. compress: if True the runs of identical data in each step of a SEQ file, such as long idle stretches, are
+        stored once as a short waveform with a repeat count in the seq file, see run_length_segments. A compressed step
+        then loops until the next jump instead of being repeated a fixed number of times.
+        9. inmemory: if True each file is encoded into a buffer kept in self.buffers, in the order written, which
+        AWG520.sendfiles can upload without going through the disk. The files are then only written to dirpath as a
+        copy if dirpath is not None. Worker processes cannot be used with inmemory.
          """
         # first we clear out the directory
-        import os
         self.dirpath = dirpath  # will normally write to sequencefiles directory, change this after initialization if
         # you want the files stored elsewhere.
-        for filename in os.listdir(self.dirpath):
-            if (filename.endswith('.wfm') or filename.endswith('.seq')):
-                os.unlink(filename)
-                #print(filename) # used this to test that it works correctly
+        if self.dirpath is not None:
+            for filename in os.listdir(self.dirpath):
+                if (filename.endswith('.wfm') or filename.endswith('.seq')):
+                    os.unlink(self.dirpath / filename)
+                    #print(filename) # used this to test that it works correctly
        # now initalize the other variables
-        self.logger = logging.getLogger('awg520private.awg520_file')
-        self.wfmheader = b'MAGIC 1000 \r\n'
-        self.seqheader = 'MAGIC 3002 \r\n'
+        self.setup_writer(timeres, dirpath, writemode, compress, inmemory)
+        if inmemory and workers is not None and workers > 1:
+            self.logger.error('In memory AWG files cannot be written by worker processes')
+            raise ValueError('In memory AWG files cannot be written by worker processes')
+        self.workers = workers
+        self.stream = stream
         # default params if no sequence object is given
         newpulseparams = {'amplitude': 100, 'pulsewidth': 50, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
                      'skew phase': 0.0, 'num pulses': 1}
         delay = [820,10]
         seq = [['S2', '1000', '1400'], ['Wave', '1000', '1400', 'Sech'], ['Green', '1400', '3400']]
-        self.timeres = timeres
 
         if ftype == 'WFM':
             self.sequencelist = None
@@ -304,13 +537,39 @@ class AWGFile(object):
                     pulseparams=newpulseparams,timeres=1)
             else:
                 self.sequences = sequencelist
-            self.sequences.create_sequence_list()
+            if not (self.parallel() or self.stream):
+                self.sequences.create_sequence_list()
         else:
             self.logger.error('AWG File type has to be either WFM or SEQ')
             raise ValueError('AWG File type has to be either WFM or SEQ')
 
         self.logger.info("Initializing AWG File instance of type:{0}".format(ftype))
 
+    @classmethod
+    def writer(cls, timeres=1, dirpath=dirpath, writemode='buffered', compress=False):
+        """returns an AWGFile that only writes wfm files, without clearing the directory or compiling a sequence. This
+        is what the worker processes use to write the steps of a sequence list."""
+        awgfile = cls.__new__(cls)
+        awgfile.setup_writer(timeres, dirpath, writemode, compress)
+        return awgfile
+
+    def setup_writer(self, timeres, dirpath, writemode, compress=False, inmemory=False):
+        self.logger = logging.getLogger('awg520private.awg520_file')
+        self.wfmheader = b'MAGIC 1000 \r\n'
+        self.seqheader = 'MAGIC 3002 \r\n'
+        self.dirpath = dirpath
+        self.timeres = timeres
+        if writemode not in ('buffered', 'mmap'):
+            self.logger.error('AWG File write mode has to be either buffered or mmap')
+            raise ValueError('AWG File write mode has to be either buffered or mmap')
+        self.writemode = writemode
+        self.compress = compress
+        self.inmemory = inmemory
+        self.buffers = {}
+        self.wfmfiles = {}
+
+    def parallel(self):
+        return self.workers is not None and self.workers > 1
 
     def maketrailer(self):
         #trailer = 'CLOCK 1.0000000000E+07\r\n' # default clock value is 100 ns
@@ -329,24 +588,22 @@ class AWGFile(object):
         return trailer
 
     def binarymaker(self,iqdata,marker):
-        '''This function makes binary strings to write to the wfm file from the I/Q data and marker data'''
+        '''This function makes binary strings to write to the wfm file from the I/Q data and marker data. The records
+        are filled in one pass into a packed structured array and returned as a zero-copy uint8 view of that array,
+        whose bytes are the same as packing each sample with struct.pack('<fb',...)'''
         try:
             wfmlen = len(iqdata)
             if wfmlen >= _WFM_MEMORY_LIMIT:
                 raise ValueError('Waveform memory limit exceeded')
             elif wfmlen == len(marker):
                 # analog I/Q data converted to 4 byte float, marker to 1 byte , both little-endian
-                record = struct.pack('<fb', iqdata[0], marker[0])
-                i = 1
-                recordsize = struct.calcsize('<fb')
+                recordsize = _WFMTYPE.itemsize
                 numbytes = wfmlen * recordsize
-                t = time.process_time()
-                while (i < wfmlen):
-                    record += struct.pack('<fb', iqdata[i], marker[i])
-                    i += 1
-                elapsed_time = time.process_time() - t
-                self.logger.info("Elapsed time in creating binary record is {0:6f} secs".format(elapsed_time))
-                return (numbytes, recordsize, record)
+                with profiler.span('encode', numbytes):
+                    record = np.empty(wfmlen, dtype=_WFMTYPE)
+                    record['iq'] = iqdata
+                    record['marker'] = marker
+                return (numbytes, recordsize, record.view(np.uint8))
             else:
                 raise ValueError('length of marker and analog data must be same')
         except ValueError as err:
@@ -355,6 +612,63 @@ class AWGFile(object):
             return (None,None,None)
 
 
+    def makeprefix(self, numbytes):
+        '''This function makes the header and the #<numdigits><numbytes> part of the body of a wfm file'''
+        # converts nbytes to a str, and then finds number of digits in str and adds it to the header
+        nbytestr = '#' + str(len(str(numbytes))) + str(numbytes)
+        return self.wfmheader + nbytestr.encode()
+
+    def mmapwriter(self, wfmfile, wavedata, markerdata):
+        '''This function sizes the wfm file up front, memory maps it and fills the records in place, so that the
+        waveform never exists as a separate bytes object in memory'''
+        wfmlen = len(wavedata)
+        if wfmlen >= _WFM_MEMORY_LIMIT:
+            raise ValueError('Waveform memory limit exceeded')
+        elif wfmlen != len(markerdata):
+            raise ValueError('length of marker and analog data must be same')
+        numbytes = wfmlen * _WFMTYPE.itemsize
+        prefix = self.makeprefix(numbytes)
+        trailer = self.maketrailer()
+        filesize = len(prefix) + numbytes + len(trailer)
+        # the records are encoded straight into the file, so with mmap encoding is part of the write stage
+        with profiler.span('write', filesize), open(wfmfile, 'w+b') as wfile:
+            wfile.truncate(filesize)
+            with mmap.mmap(wfile.fileno(), filesize) as mm:
+                mm[:len(prefix)] = prefix
+                record = np.ndarray(wfmlen, dtype=_WFMTYPE, buffer=mm, offset=len(prefix))
+                record['iq'] = wavedata
+                record['marker'] = markerdata
+                del record  # the view has to be released before the map can be closed
+                mm[len(prefix) + numbytes:] = trailer
+
+    def memorywriter(self, wfmfilename, wavedata, markerdata):
+        '''This function encodes the whole wfm file into a bytearray that is kept in self.buffers, the records are
+        filled in place as in mmapwriter. The file is also written to dirpath if it is not None'''
+        wfmlen = len(wavedata)
+        if wfmlen >= _WFM_MEMORY_LIMIT:
+            raise ValueError('Waveform memory limit exceeded')
+        elif wfmlen != len(markerdata):
+            raise ValueError('length of marker and analog data must be same')
+        numbytes = wfmlen * _WFMTYPE.itemsize
+        prefix = self.makeprefix(numbytes)
+        trailer = self.maketrailer()
+        with profiler.span('encode', numbytes):
+            buf = bytearray(len(prefix) + numbytes + len(trailer))
+            buf[:len(prefix)] = prefix
+            record = np.ndarray(wfmlen, dtype=_WFMTYPE, buffer=buf, offset=len(prefix))
+            record['iq'] = wavedata
+            record['marker'] = markerdata
+            del record  # a bytearray cannot be resized while a view of it exists
+            buf[len(prefix) + numbytes:] = trailer
+        self.savebuffer(wfmfilename, buf)
+
+    def savebuffer(self, filename, buf):
+        '''keeps the encoded file in self.buffers, and writes a copy of it to dirpath if that is not None'''
+        self.buffers[filename] = buf
+        if self.dirpath is not None:
+            with profiler.span('write', len(buf)), open(self.dirpath / filename, 'wb') as wfile:
+                wfile.write(buf)
+
     def write_waveform(self, wavename, channelnum, wavedata,markerdata):
         '''This function writes a new waveform file. the args are:
             wavename: str describing the type of wfm, usually just a number
@@ -364,14 +678,19 @@ class AWGFile(object):
         '''
         try:
             wfmfilename =  str(wavename)+'_'+str(channelnum)+str('.wfm')
+            if self.inmemory:
+                self.memorywriter(wfmfilename, wavedata, markerdata)
+                return
+            if self.writemode == 'mmap':
+                self.mmapwriter(self.dirpath / wfmfilename, wavedata, markerdata)
+                return
             with open(self.dirpath/wfmfilename,'wb') as wfile:
-                wfile.write(self.wfmheader)
                 nbytes, rsize, record = self.binarymaker(wavedata, markerdata)
-                # next line converts nbytes to a str, and then finds number of digits in str and writes it to file as a str
-                nbytestr = '#' + str(len(str(nbytes))) + str(nbytes)
-                wfile.write(nbytestr.encode())
-                wfile.write(record)
-                wfile.write(self.maketrailer())
+                with profiler.span('write') as span:
+                    wfile.write(self.makeprefix(nbytes))
+                    wfile.write(record)
+                    wfile.write(self.maketrailer())
+                    span.add_bytes(wfile.tell())
         except (IOError,ValueError) as error:
             # sys.stderr.write(sys.exc_info())
             # sys.stderr.write(error.message+'\n')
@@ -385,30 +704,33 @@ class AWGFile(object):
         seqfilename: str with seq file name to be written
         repeat: number of repetitions of each waveform
         timeres: clock rate
+        The first seq file line of each step is stored in self.steplines, this is the line to jump to for the step.
         '''
-        # first create an empty waveform so that measurements can start after a trigger is received.
-        slist = self.sequences.sequencelist
-        wfmlen = len(slist[0].c1markerdata)
-        scanlen = len(slist)
-        c1m1 = np.zeros(wfmlen,dtype=_MARKTYPE)
-        c2m1 = np.zeros(wfmlen,dtype=_MARKTYPE)
-        wave = np.zeros((2,wfmlen),dtype = _IQTYPE)
-        self.write_waveform('0', 1, wave[0,:], c1m1)
-        self.write_waveform('0', 2, wave[1,:], c2m1)
-        # create scan.seq file
+        # identical waveforms of a channel are only written once and the seq file lines point to the shared file
+        self.wfmfiles = {}
         try:
-            with open(self.dirpath / seqfilename, 'w') as sfile:
+            if self.parallel() and not self.sequences.sequencelist:
+                # the steps have not been compiled, so the length of the empty waveform comes from the event table
+                steps = self.sequences.step_sequences()
+                self.write_blank_waveform(self.sequences.new_sequence(*steps[0]).create_events(dt=0))
+                stepsegments = self.write_steps_parallel(steps)
+            else:
+                # a sequence list that was not compiled up front is streamed one step at a time
+                stepsegments = self.write_steps(self.sequences.sequencelist or self.sequences.iter_sequences())
+            self.logger.info("Wrote {0} wfm files for {1} steps".format(len(self.wfmfiles), len(stepsegments)))
+            lines = self.make_seq_lines(stepsegments, repeat)
+            # create scan.seq file
+            if self.inmemory:
+                seqtext = (self.seqheader + 'LINES ' + str(len(lines)) + '\r\n' + ''.join(lines) +
+                           'JUMP_MODE SOFTWARE\r\n')
+                self.savebuffer(seqfilename, seqtext.encode())
+                return
+            with profiler.span('write') as span, open(self.dirpath / seqfilename, 'w') as sfile:
                 sfile.write(self.seqheader)
-                sfile.write('LINES ' + str(scanlen + 1) + '\r\n')
-                sfile.write('"0_1.wfm","0_2.wfm",0,1,0,0\r\n')
-                for i in list(range(scanlen)):
-                    self.write_waveform('' + str(i + 1), 1, slist[i].wavedata[0, :], slist[i].c1markerdata)
-                    self.write_waveform('' + str(i + 1), 2, slist[i].wavedata[1, :], \
-                        slist[i].c2markerdata)
-                    linestr = '"' + str(i + 1) + '_1.wfm"' + ',' + '"' + str(i + 1) + '_2.wfm"' + ',' + str(repeat) \
-                              + ',1,0,0\r\n'
-                    sfile.write(linestr)
+                sfile.write('LINES ' + str(len(lines)) + '\r\n')
+                sfile.writelines(lines)
                 sfile.write('JUMP_MODE SOFTWARE\r\n')
+                span.add_bytes(sfile.tell())
         except (IOError, ValueError) as error:
             # sys.stderr.write(sys.exc_info())
             # sys.stderr.write(error.message+'\n')
@@ -416,6 +738,113 @@ class AWGFile(object):
             self.logger.error("Error occurred in either file I/O or data conversion:{0}".format(error))
             raise
 
+    def make_seq_lines(self, stepsegments, repeat):
+        '''makes the lines of the seq file from the segments of each step and stores the first line of each step in
+        self.steplines. A step that is a single waveform is one line that is repeated. A compressed step plays its
+        segments in a loop until the next jump: the first segment waits for the trigger, and a copy of it without the
+        wait closes the loop with a goto to the second line of the step.'''
+        lines = ['"0_1.wfm","0_2.wfm",0,1,0,0\r\n']
+        self.steplines = []
+        for segments in stepsegments:
+            first = len(lines) + 1
+            self.steplines.append(first)
+            if len(segments) == 1 and segments[0][2] is None:
+                (c1filename, c2filename, segrepeat) = segments[0]
+                lines.append(seq_line(c1filename, c2filename, repeat, 1, 0))
+            else:
+                (c1filename, c2filename, segrepeat) = segments[0]
+                lines.append(seq_line(c1filename, c2filename, segrepeat, 1, 0))
+                for (c1filename, c2filename, segrepeat) in segments[1:]:
+                    lines.append(seq_line(c1filename, c2filename, segrepeat, 0, 0))
+                (c1filename, c2filename, segrepeat) = segments[0]
+                lines.append(seq_line(c1filename, c2filename, segrepeat, 0, first + 1))
+        if len(lines) > _SEQ_MEMORY_LIMIT:
+            self.logger.error('Sequence memory limit exceeded, the seq file needs {0} lines'.format(len(lines)))
+            raise ValueError('Sequence memory limit exceeded, the seq file needs {0} lines'.format(len(lines)))
+        return lines
+
+    def write_blank_waveform(self, wfmlen):
+        '''writes the empty 0_1.wfm and 0_2.wfm waveforms so that measurements can start after a trigger is received.
+        With compression the empty waveform is a single block, which the zero runs of the steps can share'''
+        if self.compress:
+            wfmlen = min(wfmlen, _RLE_BLOCK)
+        c1m1 = np.zeros(wfmlen,dtype=_MARKTYPE)
+        c2m1 = np.zeros(wfmlen,dtype=_MARKTYPE)
+        wave = np.zeros((2,wfmlen),dtype = _IQTYPE)
+        self.write_unique_waveform('0', 1, wave[0,:], c1m1)
+        self.write_unique_waveform('0', 2, wave[1,:], c2m1)
+
+    def write_unique_waveform(self, wavename, channelnum, wavedata, markerdata):
+        '''writes the waveform only if the channel does not have a file with the same data yet, and returns the name of
+        the file that holds the data. The args are the same as for write_waveform'''
+        key = (channelnum, waveform_digest(wavedata, markerdata))
+        if key not in self.wfmfiles:
+            self.write_waveform(wavename, channelnum, wavedata, markerdata)
+            self.wfmfiles[key] = str(wavename) + '_' + str(channelnum) + '.wfm'
+        return self.wfmfiles[key]
+
+    def write_step(self, stepnum, s):
+        '''writes the wfm files of one compiled step and returns its segments as a list of (channel 1 file, channel 2
+        file, repeat) tuples. Without compression the step is a single segment with a repeat of None, which means the
+        repeat given to write_sequence. With compression the step is split by run_length_segments, the segments of
+        step N are named N-1, N-2 etc., and the segments are checked to expand back to the data of the step.
+        '''
+        segments = run_length_segments(s.wavedata, s.c1markerdata, s.c2markerdata) if self.compress else []
+        if len(segments) <= 1:
+            return [(self.write_unique_waveform(str(stepnum), 1, s.wavedata[0, :], s.c1markerdata),
+                     self.write_unique_waveform(str(stepnum), 2, s.wavedata[1, :], s.c2markerdata), None)]
+        for data in (s.wavedata[0, :], s.wavedata[1, :], s.c1markerdata, s.c2markerdata):
+            if expand_segments(data, segments).tobytes() != data.tobytes():
+                self.logger.error('Compressed segments of step {0} do not expand to its data'.format(stepnum))
+                raise RuntimeError('Compressed segments of step {0} do not expand to its data'.format(stepnum))
+        stepsegments = []
+        for (segnum, (start, stop, repeat)) in enumerate(segments, 1):
+            wavename = str(stepnum) + '-' + str(segnum)
+            stepsegments.append((
+                self.write_unique_waveform(wavename, 1, s.wavedata[0, start:stop], s.c1markerdata[start:stop]),
+                self.write_unique_waveform(wavename, 2, s.wavedata[1, start:stop], s.c2markerdata[start:stop]),
+                repeat))
+        return stepsegments
+
+    def write_steps(self, sequences):
+        '''writes the wfm files of each compiled step as it arrives and returns the list of segments of each step, see
+        write_step. Nothing is kept of a step once its files are written, so a generator of steps is written in
+        constant memory. The args are:
+        sequences: list or iterator of compiled Sequence objects, one per step
+        '''
+        stepsegments = []
+        for s in sequences:
+            if not stepsegments:
+                self.write_blank_waveform(len(s.c1markerdata))
+            stepsegments.append(self.write_step(len(stepsegments) + 1, s))
+        return stepsegments
+
+    def write_steps_parallel(self, steps):
+        '''compiles the steps of the sequence list and writes their wfm files in a pool of worker processes. Only the
+        segments of each step and the digests of the files written come back from the workers. As the workers cannot
+        see each other's files, the files that turn out to be duplicates are removed afterwards. Returns the list of
+        segments of each step, see write_step. The args are:
+        steps: list of (sequence, pulseparams) of each step as returned by SequenceList.step_sequences
+        '''
+        slist = self.sequences
+        args = [(i + 1, seq, slist.delay, params, slist.connectiondict, self.timeres, self.dirpath, self.writemode,
+                 self.compress) for (i, (seq, params)) in enumerate(steps)]
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(compile_and_write_step, args))
+        self.logger.info("Wrote {0} steps with {1} workers".format(len(results), self.workers))
+        stepsegments = []
+        for (segments, wfmfiles) in results:
+            renamed = {}
+            for (key, filename) in wfmfiles.items():
+                if key in self.wfmfiles:
+                    os.unlink(self.dirpath / filename)
+                else:
+                    self.wfmfiles[key] = filename
+                renamed[filename] = self.wfmfiles[key]
+            stepsegments.append([(renamed[c1filename], renamed[c2filename], repeat) for
+                                 (c1filename, c2filename, repeat) in segments])
+        return stepsegments
+
     def setwaveform(self, wavenum, wavedata,markerdata):
         pass
 
@@ -440,4 +869,189 @@ class AWGFile(object):
 
 
 
-    
\ No newline at end of file
+    
+
+
+class ScanPlan(object):
+    def __init__(self, sequencelist, compress=False, memorylimit=_AWG_MEMORY_LIMIT, linelimit=_SEQ_MEMORY_LIMIT):
+        """Class that checks a scan against the memory of the AWG before any waveform is compiled, and splits the scan
+        into chunks that each fit in the AWG if it is too large. The number of points of each step is found from its
+        event table, which is cheap to make. Args are:
+        1. sequencelist: the SequenceList of the scan
+        2. compress: True if the steps will be written with compression, see AWGFile
+        3. memorylimit: number of points of waveform memory per channel of the AWG
+        4. linelimit: number of lines a seq file can have
+        A step that cannot fit in the AWG by itself raises a ValueError. The chunks are stored in self.chunks as a list
+        of (first step, stop step), and chunk_sequences returns the SequenceList of each chunk.
+        """
+        self.logger = logging.getLogger('awg520private.scan_plan')
+        self.sequencelist = sequencelist
+        self.compress = compress
+        self.steplengths = []
+        self.stepcosts = []
+        for (stepnum, step) in enumerate(sequencelist.step_sequences(), 1):
+            s = sequencelist.new_sequence(*step)
+            s.create_events(dt=0)
+            if s.maxend >= _WFM_MEMORY_LIMIT and not compress:
+                self.logger.error('Step {0} has {1} points, more than a waveform can hold'.format(stepnum, s.maxend))
+                raise ValueError('Step {0} has {1} points, more than a waveform can hold'.format(stepnum, s.maxend))
+            self.steplengths.append(s.maxend)
+            self.stepcosts.append(self.estimate_step(s))
+        self.chunks = self.make_chunks(memorylimit, linelimit)
+        self.logger.info('Scan of {0} steps planned as {1} chunks'.format(len(self.steplengths), len(self.chunks)))
+
+    def estimate_step(self, s):
+        """returns the (points, seq file lines) a step will need at most. Without compression a step is one waveform
+        of all its points on one line. With compression only the Wave rows are counted in full, and each stretch
+        between the start and stop of two rows can add at most a literal and a repeated segment of about a block."""
+        if not self.compress:
+            return (s.maxend, 1)
+        stretches = 2 * len(s.eventtable.events) + 1
+        wavepoints = int(s.eventtable.channel_events(_WAVE)['duration'].sum())
+        return (min(s.maxend, wavepoints + 3 * _RLE_BLOCK * stretches), 2 * stretches + 1)
+
+    def blank_cost(self, stepnum):
+        """returns the (points, seq file lines) of the empty waveform written before the steps of a chunk"""
+        return (_RLE_BLOCK if self.compress else self.steplengths[stepnum], 1)
+
+    def make_chunks(self, memorylimit, linelimit):
+        """splits the steps into chunks in order, each with as many steps as the memory and the lines allow"""
+        chunks = []
+        first = 0
+        (points, lines) = self.blank_cost(0) if self.steplengths else (0, 0)
+        for (stepnum, (steppoints, steplines)) in enumerate(self.stepcosts):
+            if points + steppoints > memorylimit or lines + steplines > linelimit:
+                (points, lines) = self.blank_cost(stepnum)
+                if stepnum == first or points + steppoints > memorylimit or lines + steplines > linelimit:
+                    self.logger.error('Step {0} does not fit in the AWG memory by itself'.format(stepnum + 1))
+                    raise ValueError('Step {0} does not fit in the AWG memory by itself'.format(stepnum + 1))
+                chunks.append((first, stepnum))
+                first = stepnum
+            points += steppoints
+            lines += steplines
+        chunks.append((first, len(self.stepcosts)))
+        return chunks
+
+    def chunk_sequences(self):
+        """returns the SequenceList of each chunk of the scan"""
+        if len(self.chunks) == 1:
+            return [self.sequencelist]
+        return [self.sequencelist.chunk(first, stop) for (first, stop) in self.chunks]
+
+
+class MemoryReader(object):
+    def __init__(self, data):
+        """File like reader over a buffer, used to upload an encoded file with FTP.storbinary. Each read returns a
+        memoryview of the next part of the buffer, so the data is never copied. The views handed out are released by
+        close, so that the buffer can be resized or reused once it has been read."""
+        self.view = memoryview(data).cast('B')
+        self.pos = 0
+        self.chunks = []
+
+    def read(self, size=-1):
+        stop = len(self.view) if size is None or size < 0 else min(self.pos + size, len(self.view))
+        chunk = self.view[self.pos:stop]
+        self.chunks.append(chunk)
+        self.pos = stop
+        return chunk
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        for chunk in self.chunks:
+            chunk.release()
+        self.chunks = []
+        self.view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def file_digest(data):
+    """returns a hash of the bytes of a file"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def open_local(fileLocal):
+    """returns a reader for a file to be sent to the AWG, which is either a path or a buffer holding the file"""
+    if isinstance(fileLocal, (bytes, bytearray, memoryview)):
+        return MemoryReader(fileLocal)
+    return open(fileLocal, 'rb')
+
+
+def compile_and_write_step(args):
+    """Worker used by AWGFile.write_sequence to compile one step of a sequence list and write its wfm files in another
+    process, only the segments of the step and the digests of the files written are sent back."""
+    (stepnum, seq, delay, pulseparams, connectiondict, timeres, dirpath, writemode, compress) = args
+    s = Sequence(seq, delay=delay, pulseparams=pulseparams, connectiondict=connectiondict, timeres=timeres)
+    s.create_sequence(dt=0)
+    awgfile = AWGFile.writer(timeres=timeres, dirpath=dirpath, writemode=writemode, compress=compress)
+    segments = awgfile.write_step(stepnum, s)
+    return (segments, awgfile.wfmfiles)
+
+
+def seq_line(c1filename, c2filename, repeat, wait, goto):
+    """returns one line of a seq file, with the waveforms of the 2 channels, the repeat count, wait for trigger, goto
+    line and the logic jump which is not used"""
+    return '"' + c1filename + '","' + c2filename + '",' + str(repeat) + ',' + str(wait) + ',' + str(goto) + ',0\r\n'
+
+
+def run_length_segments(wavedata, c1markerdata, c2markerdata, blocksize=_RLE_BLOCK, minrepeat=_RLE_MIN_REPEAT):
+    """Splits the data of a step into (start, stop, repeat) segments, where the points start:stop are played repeat
+    times in a row. Runs of at least minrepeat identical blocks of blocksize points become one block with a repeat
+    count, everything else is kept as it is, and every segment has at least blocksize points."""
+    wfmlen = len(c1markerdata)
+    # a last partial block stays with the full block before it, so only the full blocks before those can repeat
+    nblocks = wfmlen // blocksize - (1 if wfmlen % blocksize else 0)
+    if nblocks < minrepeat:
+        return [(0, wfmlen, 1)]
+    same = np.ones(nblocks - 1, dtype=bool)
+    for data in (wavedata[0, :], wavedata[1, :], c1markerdata, c2markerdata):
+        # compare the bits, since 0.0 and -0.0 are equal floats but not equal waveforms
+        data = np.ascontiguousarray(data)
+        blocks = data.view('u' + str(data.itemsize))[:nblocks * blocksize].reshape(nblocks, blocksize)
+        same &= np.all(blocks[1:] == blocks[:-1], axis=1)
+    runstarts = np.flatnonzero(np.concatenate(([True], ~same)))
+    runlengths = np.diff(np.append(runstarts, nblocks))
+    segments = []
+    literal = 0  # first point that is not in a segment yet
+    for (block, count) in zip(runstarts.tolist(), runlengths.tolist()):
+        if count >= minrepeat:
+            segments.extend(literal_segments(literal, block * blocksize))
+            for repeatstart in range(0, count, _SEQ_REPEAT_LIMIT):
+                repeat = min(count - repeatstart, _SEQ_REPEAT_LIMIT)
+                segments.append((block * blocksize, (block + 1) * blocksize, repeat))
+            literal = (block + count) * blocksize
+    segments.extend(literal_segments(literal, wfmlen))
+    return segments
+
+
+def literal_segments(start, stop):
+    """returns the (start, stop, 1) segments that play the points start:stop once, split so that each one fits in the
+    waveform memory"""
+    maxlen = _WFM_MEMORY_LIMIT // 2
+    segments = []
+    while stop - start >= _WFM_MEMORY_LIMIT:
+        segments.append((start, start + maxlen, 1))
+        start += maxlen
+    if stop > start:
+        segments.append((start, stop, 1))
+    return segments
+
+
+def expand_segments(data, segments):
+    """returns the data played by the segments, used to check that a compressed step is the same as the original"""
+    return np.concatenate([np.tile(data[start:stop], repeat) for (start, stop, repeat) in segments])
+
+
+def waveform_digest(wavedata, markerdata):
+    """returns a hash of the I/Q and marker data of one channel, waveforms with the same data have the same digest"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(wavedata, dtype=_IQTYPE).data)
+    digest.update(np.ascontiguousarray(markerdata, dtype=_MARKTYPE).data)
+    return digest.hexdigest()
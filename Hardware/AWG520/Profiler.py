@@ -0,0 +1,118 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import time
+import threading
+
+# the stages of preparing an upload, in the order they are reported
+_STAGES = ('parse', 'events', 'pulses', 'markers', 'encode', 'write', 'transfer')
+_MB = 1048576
+
+
+class Span(object):
+    __slots__ = ('profiler', 'name', 'nbytes', 'wall', 'cpu')
+
+    def __init__(self, profiler, name, nbytes=0):
+        """Context manager that times one pass through a stage and adds it to the profiler on exit, with args:
+        1. profiler: the Profiler the time is added to
+        2. name: name of the stage, one of _STAGES or any other name
+        3. nbytes: bytes handled in the stage, more can be added with add_bytes once they are known
+        """
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu, self.nbytes)
+        return False
+
+
+class NullSpan(object):
+    """the span given out while the profiler is off, it does nothing so that the timed code costs the same as without
+    it"""
+    __slots__ = ()
+
+    def add_bytes(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = NullSpan()
+
+
+class Profiler(object):
+    def __init__(self, enabled=False):
+        """Class that keeps the calls, wall time, cpu time and bytes of each named stage. The code to be timed is put in
+        a with profiler.span(name) block. While enabled is False, which is the default, span returns a span that does
+        nothing, so the profiler can be switched on and off at any time by setting enabled. Spans run in worker
+        processes are not seen by the profiler of the main process."""
+        self.enabled = enabled
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def span(self, name, nbytes=0):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, nbytes)
+
+    def record(self, name, wall, cpu, nbytes=0):
+        with self.lock:
+            stat = self.stats.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'bytes': 0})
+            stat['calls'] += 1
+            stat['wall_s'] += wall
+            stat['cpu_s'] += cpu
+            stat['bytes'] += nbytes
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def summary(self):
+        """returns a list with a dict for each stage that was timed, the stages of _STAGES come first and in order"""
+        with self.lock:
+            names = [name for name in _STAGES if name in self.stats] + sorted(set(self.stats) - set(_STAGES))
+            return [dict(stage=name, **self.stats[name]) for name in names]
+
+    def report(self):
+        """returns the summary as a table, one line per stage"""
+        lines = ['{0:>10s} {1:>8s} {2:>10s} {3:>10s} {4:>10s}'.format('stage', 'calls', 'wall (s)', 'cpu (s)', 'MB')]
+        for stat in self.summary():
+            lines.append('{0:>10s} {1:8d} {2:10.4f} {3:10.4f} {4:10.3f}'.format(stat['stage'], stat['calls'],
+                                                                             stat['wall_s'], stat['cpu_s'],
+                                                                             stat['bytes'] / _MB))
+        return '\n'.join(lines)
+
+    def short_report(self):
+        """returns the wall time of each stage on one line, short enough for a status bar"""
+        summary = self.summary()
+        total = sum(stat['wall_s'] for stat in summary)
+        stages = ', '.join('{0} {1:.2f} s'.format(stat['stage'], stat['wall_s']) for stat in summary)
+        return 'Upload prepared in {0:.2f} s: {1}'.format(total, stages)
+
+
+# the profiler used by the sequence, file writing and upload code
+profiler = Profiler()
@@ -17,7 +17,9 @@
 
 import numpy as np
 import sys
+import os
 import logging
+from collections import OrderedDict
 
 _DAC_BITS = 10   # AWG 520 has only 10 bits
 _DAC_UPPER = 1024.0 # DAC has only 1024 levels
@@ -25,8 +27,193 @@ _DAC_MID = 512
 _IQTYPE = np.dtype('<f4') # AWG520 stores analog values as 4 bytes in little-endian format
 _MARKTYPE = np.dtype('<i1') # AWG520 stores marker values as 1 byte
 
+_ENVELOPE_CACHE_ENTRIES = 512 # at most this many envelopes are kept in the cache
+_ENVELOPE_CACHE_BYTES = 64 * 1024 * 1024 # and they can use at most this much memory
+_CARRIER_CACHE_ENTRIES = 16 # number of carrier tables kept, each one is as long as the longest sequence
+_CARRIER_MIN_LENGTH = 1024 # shortest carrier table made, tables are grown to the next power of 2 samples
+_WAVEFILE_CACHE_ENTRIES = 64 # number of wave files, and of resampled waveforms, kept in memory
+
 pulselogger = logging.getLogger('awg520.pulselogger')
 
+class EnvelopeCache(object):
+    def __init__(self, maxentries=_ENVELOPE_CACHE_ENTRIES, maxbytes=_ENVELOPE_CACHE_BYTES):
+        """Least recently used cache of pulse envelopes, keyed on a tuple of (shape, width, deviation, amp). The
+        envelopes are stored as read-only arrays of the dtype the shape makes them in, so that the carrier multiply is
+        done at the same precision as before they were cached, and the least recently used ones are dropped when either
+        maxentries or maxbytes is exceeded. The hits and misses are counted so the cache can be checked."""
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generator):
+        """returns the envelope stored for key, or calls generator() to make it and stores it"""
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        data = np.array(generator())
+        data.setflags(write=False)
+        if data.nbytes <= self.maxbytes:
+            self.entries[key] = data
+            self.nbytes += data.nbytes
+            while len(self.entries) > self.maxentries or self.nbytes > self.maxbytes:
+                oldkey, olddata = self.entries.popitem(last=False)
+                self.nbytes -= olddata.nbytes
+        return data
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+# the cache shared by all the pulses, the envelope parameters don't change between the steps of time and number scans
+envelope_cache = EnvelopeCache()
+
+class CarrierCache(object):
+    def __init__(self, maxentries=_CARRIER_CACHE_ENTRIES):
+        """Least recently used cache of the I and Q carriers on the global timebase of a sequence, keyed on a tuple of
+        (ssb_freq, phase, skew_phase, iqscale). Each entry holds the cos and the scaled sin carrier from sample 0 of
+        the sequence, so a pulse starting at any sample takes its slice of the table and the SSB phase stays
+        continuous from one pulse to the next. A table is remade longer when a longer sequence needs it."""
+        self.maxentries = maxentries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, length, ssb_freq, phase, skew_phase, iqscale):
+        """returns the (I carrier, Q carrier) arrays, which have at least length samples"""
+        key = (ssb_freq, phase, skew_phase, iqscale)
+        if key in self.entries and len(self.entries[key][0]) >= length:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        # round up so that the small increases in length during a time scan don't remake the table every step
+        size = max(_CARRIER_MIN_LENGTH, 1 << (int(length) - 1).bit_length())
+        tempx = np.arange(size * 1.0)
+        icarrier = np.cos(2 * np.pi * (tempx * ssb_freq + phase / 360.0))
+        qcarrier = np.sin(2 * np.pi * (tempx * ssb_freq + phase / 360.0 + skew_phase / 360.0)) * iqscale
+        icarrier.setflags(write=False)
+        qcarrier.setflags(write=False)
+        self.entries[key] = (icarrier, qcarrier)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxentries:
+            self.entries.popitem(last=False)
+        return self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+# the carrier tables shared by all the pulses, they only change when the SSB parameters change
+carrier_cache = CarrierCache()
+
+class WaveFileCache(object):
+    def __init__(self, maxentries=_WAVEFILE_CACHE_ENTRIES, sidecar=True):
+        """Cache of the wave files used by LoadWave. Each file is parsed with genfromtxt only once, and if sidecar is
+        True its time and amplitude columns are also saved to a <file>.npy next to it, so that later sessions don't
+        parse it either. The resampled waveform of a file is kept for each width it is used at. The mtime and size of
+        the file are part of every key, and are stored in the sidecar, so a file that changes is read again."""
+        self.maxentries = maxentries
+        self.sidecar = sidecar
+        self.columns = OrderedDict()
+        self.resampled = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.parses = 0
+
+    def version(self, filename):
+        """returns the (mtime, size) of the file, raises an OSError if it cannot be found"""
+        stat = os.stat(filename)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self, filename):
+        """returns the (time, amplitude) columns of the file as float32 arrays"""
+        filename = str(filename)
+        key = (filename, self.version(filename))
+        if key in self.columns:
+            self.hits += 1
+            self.columns.move_to_end(key)
+            return self.columns[key]
+        self.misses += 1
+        columns = self.read_sidecar(filename, key[1])
+        if columns is None:
+            # load a file with amplitude and phase values written by the other module/function
+            csv = np.genfromtxt(filename, delimiter=',')
+            self.parses += 1
+            columns = (np.array(csv[:, 1], dtype=_IQTYPE), np.array(csv[:, 2], dtype=_IQTYPE))
+            self.write_sidecar(filename, key[1], columns)
+        for data in columns:
+            data.setflags(write=False)
+        self.store(self.columns, key, columns)
+        return columns
+
+    def resample(self, filename, width):
+        """returns the (amplitude, time, maximum amplitude) of the file resampled to width points"""
+        filename = str(filename)
+        key = (filename, self.version(filename), width)
+        if key in self.resampled:
+            self.resampled.move_to_end(key)
+            return self.resampled[key]
+        tt, data = self.load(filename)
+        maxamp = np.amax(data) # find maximum value before resampling
+        # now we need to resample the data to be compatible with the width
+        resampleidx = np.linspace(tt[0],tt[-1],width) # generate a list of integers which goes from
+        # tmin to tmax and has width number of samples
+        result = (np.interp(resampleidx,tt,data), np.interp(resampleidx,tt,tt), maxamp)
+        for array in result[:2]:
+            array.setflags(write=False)
+        self.store(self.resampled, key, result)
+        return result
+
+    def store(self, entries, key, value):
+        entries[key] = value
+        while len(entries) > self.maxentries:
+            entries.popitem(last=False)
+
+    def read_sidecar(self, filename, version):
+        """returns the columns saved in the sidecar of the file, or None if there is none for this version of it"""
+        if not self.sidecar:
+            return None
+        try:
+            record = np.load(filename + '.npy')
+        except (IOError, ValueError, EOFError):
+            return None
+        if record.dtype.names != ('mtime', 'size', 'tt', 'amp') or (record['mtime'][0], record['size'][0]) != version:
+            return None
+        return (np.array(record['tt'][0], dtype=_IQTYPE), np.array(record['amp'][0], dtype=_IQTYPE))
+
+    def write_sidecar(self, filename, version, columns):
+        if not self.sidecar:
+            return
+        tt, data = columns
+        record = np.zeros(1, dtype=[('mtime', '<i8'), ('size', '<i8'), ('tt', _IQTYPE, tt.shape),
+                                    ('amp', _IQTYPE, data.shape)])
+        record['mtime'], record['size'] = version
+        record['tt'][0] = tt
+        record['amp'][0] = data
+        try:
+            np.save(filename + '.npy', record)
+        except IOError as err:
+            pulselogger.warning("Could not write the sidecar of {0}: {1}".format(filename, err))
+
+    def clear(self):
+        self.columns.clear()
+        self.resampled.clear()
+        self.hits = 0
+        self.misses = 0
+        self.parses = 0
+
+# the wave files shared by all the LoadWave pulses
+wavefile_cache = WaveFileCache()
+
+
 class Pulse(object):
     def __init__(self, num, width, ssb_freq, iqscale, phase, skew_phase):
         self.vmax = 1.0  # The max voltage that AWG is using
@@ -36,6 +223,7 @@ class Pulse(object):
         self.iqscale = iqscale  # The voltage scale for different channels (i.e. the for I and Q signals). It is a floating point number.
         self.phase = phase  # The phase difference between I and Q channels in degrees
         self.skew_phase = skew_phase # corrections to the phase in degrees
+        self.start = 0 # The sample of the sequence at which the pulse starts, this sets the phase of the SSB carrier
         self.Q_data = None  # The I and Q data that will has the correction of IQ scale
         self.I_data = None  # and phase. Both of them will be an array with floating number.
 
@@ -47,12 +235,27 @@ class Pulse(object):
         # For all the pulse that needs I and Q correction, the method needs to be called after
         # you create the "raw pulse data"
 
-        # Making I and Q correction
-        tempx = np.arange(self.width * 1.0)
-        self.Q_data = np.array(data * np.sin(2 * np.pi *(tempx * self.ssb_freq  + self.phase/360.0 +
-                                                         self.skew_phase/360.0)) * \
-                      self.iqscale,dtype = _IQTYPE)
-        self.I_data = np.array(data * np.cos(2* np.pi * (tempx * self.ssb_freq + self.phase/360.0)),dtype = _IQTYPE)
+        # Making I and Q correction, using the part of the carrier from self.start so the phase is that of the
+        # absolute position of the pulse in the sequence
+        icarrier, qcarrier = self.carriers()
+        self.Q_data = np.array(data * qcarrier, dtype = _IQTYPE)
+        self.I_data = np.array(data * icarrier, dtype = _IQTYPE)
+
+    def carriers(self):
+        """returns the part of the (I carrier, Q carrier) that is under the pulse"""
+        icarrier, qcarrier = carrier_cache.get(self.start + self.width, self.ssb_freq, self.phase, self.skew_phase,
+                                               self.iqscale)
+        return (icarrier[self.start:self.start + self.width], qcarrier[self.start:self.start + self.width])
+
+    def carrier_key(self):
+        return (self.ssb_freq, self.phase, self.skew_phase, self.iqscale)
+
+    def cached_envelope(self):
+        """returns the envelope of the pulse from the envelope cache, making it if needed"""
+        return envelope_cache.get(self.cache_key(), self.envelope)
+
+    def data_generator(self):
+        self.iq_generator(self.cached_envelope())
 
 class Gaussian(Pulse):
     def __init__(self, num, width, ssb_freq, iqscale, phase,deviation, amp, skew_phase=0):
@@ -62,11 +265,14 @@ class Gaussian(Pulse):
         self.amp = amp * self.vmax/_DAC_UPPER # amp can be a value anywhere from 0 - 1000
 
 
-    def data_generator(self):
+    def envelope(self):
         data = np.arange(self.width * 1.0,dtype=_IQTYPE)
         data = np.float32(self.amp * np.exp(
             -((data - self.mean) ** 2) / (2 * self.deviation * self.deviation)))  # making a Gaussian function
-        self.iq_generator(data)
+        return data
+
+    def cache_key(self):
+        return ('Gauss', self.width, self.deviation, self.amp)
 
 class Sech(Pulse):
     def __init__(self, num, width, ssb_freq, iqscale, phase, deviation, amp, skew_phase=0):
@@ -75,12 +281,15 @@ class Sech(Pulse):
         self.deviation = deviation
         self.amp = amp * self.vmax / _DAC_UPPER # amp can be a value anywhere from 0 - 1000
 
-    def data_generator(self):
+    def envelope(self):
         data = np.arange(self.width * 1.0)
         data = np.float32(self.amp * 2.0/(np.exp((data - self.mean)/self.deviation) + np.exp(-(data -
                                                                                        self.mean)/self.deviation)))
                                # making a Sech function
-        self.iq_generator(data)
+        return data
+
+    def cache_key(self):
+        return ('Sech', self.width, self.deviation, self.amp)
 
 class Lorentzian(Pulse):
     def __init__(self, num, width, ssb_freq, iqscale, phase, deviation, amp, skew_phase=0):
@@ -90,11 +299,14 @@ class Lorentzian(Pulse):
         self.amp = amp * self.vmax / _DAC_UPPER  # amp can be a value anywhere from 0 - 100
 
 
-    def data_generator(self):
+    def envelope(self):
         data = np.arange(self.width * 1.0)
         data = np.float32(self.amp * (self.deviation**2)/(4* (np.power(data - self.mean,2) + (self.deviation/2)**2)))
                                # making a Lorentzian function
-        self.iq_generator(data)
+        return data
+
+    def cache_key(self):
+        return ('Lorentz', self.width, self.deviation, self.amp)
 
 class Square(Pulse):
     def __init__(self, num, width, ssb_freq, iqscale, phase, height, skew_phase=0):
@@ -102,9 +314,12 @@ class Square(Pulse):
         self.mean = self.width / 2.0
         self.height = height * self.vmax / _DAC_UPPER  # height can be a value anywhere from 0 - 1000
 
-    def data_generator(self):
+    def envelope(self):
         data = (np.zeros(self.width) + 1.0) * self.height  # making a Square function
-        self.iq_generator(data)
+        return data
+
+    def cache_key(self):
+        return ('Square', self.width, 0, self.height)
 
 
 class Marker(Pulse):
@@ -132,21 +347,23 @@ class LoadWave(Pulse):
         self.deviation = deviation
         self.mean = self.width/2.0
         self.filename = filename # may want to fix this so path is always the same place.
+        self.time = None
+
+    def envelope(self):
+        # the file is only parsed once and resampled once for each width, see WaveFileCache
+        data, self.time, maxamp = wavefile_cache.resample(self.filename, self.width)
+        data = data * self.amp / maxamp # normalize to maximum value
+        return data
+
+    def cache_key(self):
+        # the version of the file is in the key so that an envelope is not reused once the file has changed
+        return ('Load Wfm', str(self.filename), wavefile_cache.version(self.filename), self.width, self.deviation,
+                self.amp)
 
     def data_generator(self):
         try:
-            csv = np.genfromtxt(self.filename, delimiter=',')# load a file with amplitude and phase values written by
-            # the other module/function
-            tt = np.array(csv[:, 1],dtype = _IQTYPE)
-            data = np.array(csv[:, 2], dtype = _IQTYPE)
-            maxamp = np.amax(data) # find maximum value before resampling
-            # now we need to resample the data to be compatible with the width
-            resampleidx = np.linspace(tt[0],tt[-1],self.width) # generate a list of integers which goes from
-            # tmin to tmax and has width number of samples
-            data = np.interp(resampleidx,tt,data) # obtain values of amplitude at resampled values
-            data = data * self.amp / maxamp # normalize to maximum value
-            self.time = np.interp(resampleidx,tt,tt) # obtain time at resampled values
-            self.iq_generator(data)
+            # the resampled times are only filled in when the file is read, not when the envelope is in the cache
+            self.iq_generator(self.cached_envelope())
         except IOError as err:
             #sys.stderr.write('File error: %s', err.message)
             print("OS error: {0}".format(err))
@@ -155,10 +372,3 @@ class LoadWave(Pulse):
             pulselogger.error('Could not resample supplied waveform data')
         except:
             pulselogger.error('Unknown error')
-
-
-
-
-
-
-
@@ -15,12 +15,17 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 import numpy as np
 import logging
-import matplotlib.pyplot as plt
+import re
+import copy
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 # from collections import deque
 from pathlib import Path
 
-from .Pulse import Gaussian, Square, Marker, Sech, Lorentzian, LoadWave
-import copy
+from .Pulse import Gaussian, Square, Sech, Lorentzian, LoadWave
+from .Profiler import profiler
+from ..LogFiles import add_log_handlers
 
 maindir = Path('.')
 seqfiledir = maindir / 'sequencefiles/'
@@ -37,240 +42,223 @@ _BLANK = 'Blank' # new keyword which turns off all channels, to be implemented
 _FULL = 'Full' # new keyword which turns on all channels high, to be implemented
 # dictionary of connections from marker channels to devices,
 _CONN_DICT = {_MW_S1: None, _MW_S2: 1, _GREEN_AOM: 2, _ADWIN_TRIG: 4}
+# marker number -> (AWG channel index, bit in the marker byte), bit 0 is marker 1 and bit 1 is marker 2 of a channel
+_MARKER_BITS = {1: (0, 1), 2: (0, 2), 3: (1, 1), 4: (1, 2)}
 
 _DAC_UPPER = 1024.0  # DAC has only 1024 levels
 _DAC_MID = 512
 _IQTYPE = np.dtype('<f4')  # AWG520 stores analog values as 4 bytes in little-endian format
 _MARKTYPE = np.dtype('<i1')  # AWG520 stores marker values as 1 byte
+# bytes needed per sample for the I and Q data and the 2 channels of marker data of one step of a scan
+_STEP_BYTES = 2 * _IQTYPE.itemsize + 2 * _MARKTYPE.itemsize
+# the pulse param that is changed by each type of scan, time scans change the sequence instead
+_SCAN_PARAMS = {'amplitude': 'amplitude', 'SB freq': 'SB freq', 'pulsewidth': 'pulsewidth', 'number': 'num pulses'}
+# scans that only change the shape of the pulses and not the timing, so all the steps can be made at once
+_BATCH_SCANS = ('amplitude', 'SB freq', 'pulsewidth')
 
 modlogger = logging.getLogger('seqlogger')
-modlogger.setLevel(logging.DEBUG)
-# create a file handler that logs even debug messages
-fh = logging.FileHandler(logfiledir / 'seqlog.log')
-fh.setLevel(logging.DEBUG)
-# create a console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.ERROR)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-ch.setFormatter(formatter)
-# add the handlers to the logger
-modlogger.addHandler(fh)
-modlogger.addHandler(ch)
-
-
-def to_int(iterable):
-    return [int(x) for x in iterable]
-
+# the log file is only opened when the first message is logged
+add_log_handlers(modlogger, logfiledir / 'seqlog.log')
+
+
+''''This entire section of methods essentially helps the Sequence class that is defined below. The timing fields
+are compiled by SequenceTiming and the events of a sequence are kept in the columnar EventTable class.'''
+
+
+# a start or stop field is a sum of terms, each either an integer or an integer coefficient of t, e.g. 1000+3t-t.
+# Whitespace is allowed around the signs, numbers and t, as int() allowed it, but not inside a number
+_TIMING_EXPR = re.compile(r'\s*[+-]?\s*(\d+\s*t?|t)(\s*[+-]\s*(\d+\s*t?|t))*\s*')
+_TIMING_TERM = re.compile(r'([+-]?)\s*(\d*)\s*(t?)')
+
+
+@lru_cache(maxsize=4096)
+def compile_timing_expression(expr):
+    """Compiles a start or stop field such as '2000+t', '1000+3t' or '1000+2t-t' into the affine form offset + k*t
+    and returns the tuple (offset, k). The results are cached so that each distinct field is only parsed once."""
+    text = str(expr)
+    if not _TIMING_EXPR.fullmatch(text):
+        raise ValueError('Could not parse the timing expression {0}'.format(expr))
+    offset = 0
+    coeff = 0
+    for sign, number, tvar in _TIMING_TERM.findall(text):
+        if not (number or tvar):
+            continue
+        value = int(number) if number else 1
+        if sign == '-':
+            value = -value
+        if tvar:
+            coeff += value
+        else:
+            offset += value
+    return (offset, coeff)
 
-class Event(object):
-    """Recently added this class because I have a feeling all the sequence objects should be redefined in terms of this."""
 
-    def __init__(self, sequence):
-        self.event_dict = create_event_dictionary(sequence)
+class SequenceTiming(object):
+    def __init__(self, seq):
+        """Class that holds the start and stop fields of a sequence compiled once into offsets and coefficients of t,
+        so that the times for any increment, or for every increment of a scan at once, are found with numpy
+        arithmetic instead of parsing the strings again."""
+        terms = [compile_timing_expression(pulse[1]) + compile_timing_expression(pulse[2]) for pulse in seq]
+        terms = np.array(terms, dtype=np.int64).reshape(len(seq), 4)
+        self.offsets = terms[:, 0::2]  # the (start,stop) offsets of each line
+        self.coeffs = terms[:, 1::2]  # the (start,stop) coefficients of t of each line
 
-    def add_pulse(self, pulse):
-        pass
+    def evaluate(self, dt=0):
+        """returns an array of (start,stop) times of each line for the increment dt"""
+        return self.offsets + self.coeffs * int(dt)
 
+    def evaluate_scan(self, scanlist):
+        """returns an array of the (start,stop) times of each line for every increment in scanlist, with the scan
+        steps along the first axis"""
+        dts = np.asarray(scanlist).astype(np.int64)
+        return self.offsets[np.newaxis, :, :] + self.coeffs[np.newaxis, :, :] * dts[:, np.newaxis, np.newaxis]
 
-''''This entire section of methods essentially helps the Sequence class that is defined below and I think 
-it would be best if they were all made into part of the Event class. '''
+    def resolve(self, seq, times):
+        """returns a new sequence with the start and stop fields of each line replaced by the times given"""
+        return [[pulse[0], str(times[idx][0]), str(times[idx][1])] + list(pulse[3:]) for (idx, pulse) in
+                enumerate(seq)]
 
 
 def find_start_stop(pulse, t):
     """Helper method processes a pulse in the form [name,start,stop,type,optional params] and returns the start stop
     times and if needed adds t to the pulse events"""
-    if '+' in pulse[1]:
-        t1, t2 = pulse[1].split('+')
-        if t2 == 't':
-            start = int(t1) + t
-        else:
-            start = int(t1) + int(t2[:-1]) * t
-    else:
-        start = int(pulse[1])
-    if '+' in pulse[2]:
-        t1, t2 = pulse[2].split('+')
-        if t2 == 't':
-            stop = int(t1) + t
-        else:
-            stop = int(t1) + int(t2[:-1]) * t
-    else:
-        stop = int(pulse[2])
-    return (start, stop)
+    t1, k1 = compile_timing_expression(pulse[1])
+    t2, k2 = compile_timing_expression(pulse[2])
+    return (t1 + k1 * t, t2 + k2 * t)
 
 
 def increment_sequence_by_dt(seq, dt=0):
     """This method increments the start and stop times by dt and returns the updated sequence for processing"""
-    temp_seq = copy.deepcopy(seq)
-    for (idx, pulse) in enumerate(seq):
-        if '+' in pulse[1]:
-            t1, t2 = pulse[1].split('+')
-            if t2 == 't':
-                start = int(t1) + dt
-            else:
-                start = int(t1) + int(t2[:-1]) * dt
-        else:
-            start = int(pulse[1])
-        if '+' in pulse[2]:
-            t1, t2 = pulse[2].split('+')
-            if t2 == 't':
-                stop = int(t1) + dt
-            else:
-                stop = int(t1) + int(t2[:-1]) * dt
-        else:
-            stop = int(pulse[2])
-        temp_seq[idx][1] = str(start)
-        temp_seq[idx][2] = str(stop)
-    return temp_seq
-
-
-def sort_event_dictionary(evt_dict):
-    """This function sorts each channel using the start time of the pulses in each channel"""
-    tmp_dict = copy.deepcopy(evt_dict)
-    # sort the new dictionary
-    for k, v in tmp_dict.items():
-        # print('the key {} has value {}'.format(k, v))
-        new_val = sorted(v, key=lambda x: x[0])
-        tmp_dict[k] = new_val
-        # print('sorted! the key {} now has value {}'.format(k, new_val))
-    return dict(tmp_dict)
-
-
-def create_event_dictionary(seq):
-    """this function creates a dictionary with each key representing a channelname, and the values being a tuple of the
-    (start,stop,duration,pulsetype) times. This function handles multiple pulses on the same channel, and returns tuples that
-    are sorted by the start time of each event on that channel."""
-    from collections import defaultdict
-    event_dict = defaultdict(list)
-    c_list = [seq[i][0] for i in range(len(seq))]
-    start_list = to_int([seq[i][1] for i in range(len(seq))])
-    stop_list = to_int([seq[i][2] for i in range(len(seq))])
-    dur_list = to_int([stop_list[i] - start_list[i] for i in range(len(start_list))])
-    pulse_list=[]
-    # The code below checks if pulse has more parameters than the start, stop time, if it does
-    # not then a blank string is inserted otherwise the name of the function e.g. Gauss,sech etc
-    # is inserted
-    # TODO:possible future issue if we add more parameters to pulse, this is really crying out for a class def
-    for i in range(len(seq)):
-        if len(seq[i]) > 3:
-            pulse_list.append(seq[i][3])
-        else:
-            pulse_list.append('')
-    # create the event dictionary
-    m_list = [c_list,start_list,stop_list,dur_list,pulse_list]
-    for z in zip(*m_list):
-        event_dict[z[0]].append(z[1:])
-    # # sort each channel in the event dictionary by the start times
-    # for key, val in event_dict.items():
-    #     new_val = sorted(val, key=lambda x:x[0])
-    #     event_dict[key] = new_val
-
-    # also using another way which doesn't rely on defaultdict
-    # dict_1 = {}
-    # m_list = [c_list, start_list, stop_list, dur_list]
-    # for z in zip(*m_list):
-    #     if z[0] not in dict_1:
-    #         dict_1[z[0]] = [z[1:]]
-    #     else:
-    #         dict_1[z[0]].append(z[1:])
-
-    return sort_event_dictionary(event_dict)
-
-
-def insert_multiple_pulses_into_event_dictionary(evt_dict, pulse, n=0):
-    """This function will insert a pulse multiple times (n) into the event dictionary for the channel denoted by
-    pulse, and then push all the start times that come after this pulse by the necessary amount"""
-    temp_dict = copy.deepcopy(evt_dict)
-    push_time = 0
-    p_channel = str(pulse[0])
-    p_start = int(pulse[1])
-    p_stop = int(pulse[2])
-    p_duration = p_stop - p_start
-    for key, val in evt_dict.items():
-        start_times = [val[j][0] for j in range(len(val))]  # create a list of all the start times in that
-        # channel
-        stop_times = [val[j][1] for j in range(len(val))]  # create a list of all the stop times in that
-        # channel
-        dur_times = [val[j][2] for j in range(len(val))]  # create a list of all the duration times in that
-        # channel
-        pulse_types = [val[j][3] for j in range(len(val))]  # create a list of all the pulse types in that
-        # channel
-        # print('start times for pulse {:} are {}'.format(key,start_times))
-        # print('stop times for pulse {:} are {}'.format(key,stop_times))
-        if p_channel == key:  # if the channelname of pulse matches a particular channel in the dict
-            for i in range(n):  # insert the pulse into the dictionary while moving the start and stop times
-                new_start = [start_times[j] + (i + 1) * p_duration for j in range(len(start_times))]
-                # print('Match found! new starting times for pulse {} are {}'.format(key,new_start))
-                # new_start = start_times + i * p_duration
-                new_stop = [stop_times[j] + (i + 1) * p_duration for j in range(len(stop_times))]
-                # print('Match found! new stopping times for pulse {} are {}'.format(key,new_stop))
-                # new_stop = stop_times + i * p_duration
-                push_time += p_duration
-                # print("Push time is {}".format(push_time))
-                m_list = [new_start,new_stop,dur_times,pulse_types]
-                for z in zip(*m_list):
-                    temp_dict[key].append(z[0:])
-            # print('max new start time is {} and new stop time is {}'.format(max(new_start),max(new_stop)))
-            # print('lenght of new start is {}'.format(len(new_start)))
-        else:
-            pass
-
-    # now we have to check the other pulses in sequence and if any of them are now conflicting with the newly
-    # added pulses in the dictionary we have to move them by the push time
-    temp_dict = push_later_pulses(temp_dict, p_channel)
-    # print("the event dictionary with inserted pulses is {}".format(temp_dict))
-
-    return dict(temp_dict)
-
-
-def push_later_pulses(evt_dict, insert_channel):
-    """this function pushes the pulses that do not belong to the insert channel to later times if their original start
-    times are now less than the latest start time of the insert channel"""
-    temp_dict = copy.deepcopy(evt_dict)
-    earliest_start_time = 0
-    earliest_stop_time = 0
-    latest_start_time = 0
-    latest_stop_time = 0
-    push_time = 0
-    earliest_start_time = evt_dict[insert_channel][0][0]
-    earliest_stop_time = evt_dict[insert_channel][0][1]
-    latest_start_time = evt_dict[insert_channel][-1][0]
-    latest_stop_time = evt_dict[insert_channel][-1][1]
-    push_time = latest_start_time - earliest_start_time
-    # print("the oldest and latest start times for the inserted channel are {} and {}".format(earliest_start_time,latest_start_time))
-    # print('push time is {}'.format(push_time))
-    for channel, val in evt_dict.items():
-        if (channel != insert_channel):
-            # print('pulse {:s} is not matched with {}'.format(channel,insert_channel))
-            start_times = [val[j][0] for j in range(len(val))]  # create a list of all the start times in that
-            # channel
-            stop_times = [val[j][1] for j in range(len(val))]  # create a list of all the stop times in that
-            # channel
-            dur_times = [val[j][2] for j in range(len(val))]  # create a list of all the duration times in that
-            pulse_types = [val[j][3] for j in range(len(val))]  # create a list of all the pulse types in that
-            # channel
-            for (idx, start) in enumerate(start_times):
-                if (start > earliest_start_time) and (start < latest_stop_time):
-                    # start_times[idx] = start + push_time
-                    # stop_times[idx] = stop_times[idx] + push_time
-                    #print('Had to move this block! new starting times for pulse {} are {}'.format(channel,start+push_time))
-                    # m_list = [start_times, stop_times, dur_times,pulse_types]
-                    # for z in zip(*m_list):
-                    #     # print('the new start,stop, duration times are {0},{1},{2}'.format(z[0],z[1],z[2]))
-                    #     temp_dict[channel] = z
-                    temp_dict[channel][idx] = (start + push_time,stop_times[idx]+push_time,dur_times[idx],pulse_types[idx])
-                else:
-                    pass
+    timing = SequenceTiming(seq)
+    return timing.resolve(seq, timing.evaluate(dt))
 
-    return sort_event_dictionary(temp_dict)
 
+# one row of the event table: channel id, start, stop, duration, pulse type id and the sequence line it came from
+_EVENTTYPE = np.dtype([('channel', np.int16), ('start', np.int64), ('stop', np.int64), ('duration', np.int64),
+                       ('ptype', np.int16), ('line', np.int32)])
 
-def find_max_event(evt_dict):
-    """Helper method finds the data length of the event dictionary of pulses, returns the data length"""
-    events = list(evt_dict.values())
-    stop_times = [events[j][-1][1] for j in range(len(events))]
-    return int(max(stop_times))
+
+class EventTable(object):
+    def __init__(self, sequence=None):
+        """Class that holds the events of a sequence as a numpy structured array with one row per event, with the
+        channel and pulse type stored as ids into the channels and pulsetypes lists. The rows are kept sorted by
+        channel and then by the start time of the events in that channel. Args are:
+        1. sequence: list of [name,start,stop,optional pulse type, optional params] whose start and stop are already
+        integers (or strings of integers), i.e. after the sequence has been incremented by dt
+        """
+        self.channels = []  # the channel id of an event is its channel name's index in this list
+        self.pulsetypes = ['']  # pulse type id 0 is for events without a pulse type
+        self.events = np.zeros(0, dtype=_EVENTTYPE)
+        if sequence is not None:
+            self.add_sequence(sequence)
+
+    def channel_id(self, name):
+        """returns the id of the channel name, adding it to the channels list if it is new"""
+        if name not in self.channels:
+            self.channels.append(name)
+        return self.channels.index(name)
+
+    def pulsetype_id(self, name):
+        """returns the id of the pulse type, adding it to the pulsetypes list if it is new"""
+        if name not in self.pulsetypes:
+            self.pulsetypes.append(name)
+        return self.pulsetypes.index(name)
+
+    def has_channel(self, name):
+        return (name in self.channels) and bool(np.any(self.events['channel'] == self.channels.index(name)))
+
+    def channel_events(self, name):
+        """returns a copy of the rows of the channel, sorted by the start times"""
+        if name not in self.channels:
+            return np.zeros(0, dtype=_EVENTTYPE)
+        return self.events[self.events['channel'] == self.channels.index(name)]
+
+    def add_sequence(self, seq):
+        """adds one event per line of the sequence and sorts the table"""
+        rows = np.zeros(len(seq), dtype=_EVENTTYPE)
+        for (idx, pulse) in enumerate(seq):
+            # a blank pulse type is used if the line has no more parameters than the start and stop times
+            ptype = pulse[3] if len(pulse) > 3 else ''
+            rows[idx] = (self.channel_id(pulse[0]), int(pulse[1]), int(pulse[2]), int(pulse[2]) - int(pulse[1]),
+                         self.pulsetype_id(ptype), idx)
+        self.events = np.concatenate((self.events, rows))
+        self.sort()
+
+    def sort(self):
+        """sorts the rows by channel and then by start time, keeping the order of events with equal start times"""
+        order = np.argsort(self.events['start'], kind='stable')
+        order = order[np.argsort(self.events['channel'][order], kind='stable')]
+        self.events = self.events[order]
+
+    def fix_minimum_duration(self, channel, deviation=20):
+        """ensures that all the events of the channel have a minimum duration of 6 standard deviations, and moves the
+        stop times of the events that had to be lengthened"""
+        if channel not in self.channels:
+            return
+        short = (self.events['channel'] == self.channels.index(channel)) & (self.events['duration'] < 6 * deviation)
+        self.events['duration'][short] = 6 * deviation
+        self.events['stop'][short] = self.events['start'][short] + 6 * deviation
+
+    def insert_pulse_train(self, channel, duration, n=0):
+        """schedules n more pulses of the given duration right after every event of the channel, turning each event
+        into a train of n+1 pulses, and pushes every event on every channel that starts after the start of a train
+        by the time inserted before it. This is done in one pass with a sort of the table."""
+        if n <= 0 or channel not in self.channels:
+            return
+        cid = self.channels.index(channel)
+        train_starts = self.events['start'][self.events['channel'] == cid]  # already sorted by start time
+        # every event is pushed by the length of all the trains that started strictly before it
+        push = np.searchsorted(train_starts, self.events['start'], side='left') * (n * duration)
+        self.events['start'] += push
+        self.events['stop'] += push
+        rows = self.events[self.events['channel'] == cid]
+        copies = np.tile(rows, n)
+        shifts = np.repeat(np.arange(1, n + 1, dtype=np.int64) * duration, len(rows))
+        copies['start'] += shifts
+        copies['stop'] += shifts
+        self.events = np.concatenate((self.events, copies))
+        self.sort()
+
+    def max_event(self):
+        """returns the data length of the events, i.e. the largest stop time of the last event of each channel"""
+        channel = self.events['channel']
+        last = np.flatnonzero(np.append(channel[1:] != channel[:-1], True))
+        return int(self.events['stop'][last].max())
+
+    def same_events(self, other, names):
+        """returns True if the other table has exactly the same rows as this one for each of the channel names"""
+        if self.channels != other.channels or self.pulsetypes != other.pulsetypes:
+            return False
+        return all(np.array_equal(self.channel_events(name), other.channel_events(name)) for name in names)
+
+    def to_dict(self):
+        """returns the events as a dictionary with a key for each channel name, and the values being a list of the
+        (start,stop,duration,pulsetype) tuples of that channel, sorted by start time"""
+        evt_dict = {}
+        for (cid, start, stop, duration, ptype, line) in self.events.tolist():
+            evt_dict.setdefault(self.channels[cid], []).append((start, stop, duration, self.pulsetypes[ptype]))
+        return evt_dict
+
+
+def paint_marker(markerdata, start, stop, bit, delay=0):
+    """Helper method turns on the marker bit in markerdata from start to stop, with the event moved earlier by delay
+    samples. The waveform is played over and over, so the part of an event that is moved before the first sample is
+    painted at the end of the data, and a part moved past the end at the beginning, which is what np.roll of a full
+    length marker array used to do. Only the samples of the event are touched."""
+    length = len(markerdata)
+    stop = min(stop, length)
+    if stop <= start:
+        return
+    if stop - start >= length:
+        markerdata |= bit
+        return
+    on = (start - delay) % length
+    off = on + (stop - start)
+    if off <= length:
+        markerdata[on:off] |= bit
+    else:
+        markerdata[on:] |= bit
+        markerdata[:off - length] |= bit
 
 
 def find_data_length(seq, dt=0, timeres=1):
@@ -291,25 +279,6 @@ def find_data_length(seq, dt=0, timeres=1):
     return maxend
 
 
-def fix_minimum_duration(event_dict, channel, deviation=20):
-    # this method goes through the dictionary and ensures that any channel that is specified has minimum duration of
-    # 6 standard deviations
-    tmp_dict = copy.deepcopy(event_dict)
-    for k, v in event_dict.items():
-        # we will go out at least 6 standard deviations
-        start_list = [v[j][0] for j in range(len(v))]
-        stop_list = [v[j][1] for j in range(len(v))]
-        dur_list = [v[j][2] for j in range(len(v))]  # the duration is assumed to be in the 3rd element of this tuple
-        pulse_l = [v[j][3] for j in range(len(v))]
-        if (k == channel):
-            for j in range(len(start_list)):
-                if dur_list[j] < 6 * deviation:
-                    dur_list[j] = 6 * deviation
-                    stop_list[j] = start_list[j] + dur_list[j]  # if duration was longer than specified initially update the stop time
-                    tmp_dict[k][j] = (start_list[j], stop_list[j], dur_list[j],pulse_l[j])
-    return dict(tmp_dict)
-
-
 """"End helper methods section"""
 
 
@@ -367,119 +336,168 @@ class Sequence(object):
         npulses = self.pulseparams['num pulses']
         return (ssb_freq, iqscale, phase, deviation, amp, skew_phase, npulses)
 
+    def create_events(self, dt=0):
+        """Creates the event table of the sequence and returns its data length, without making any of the waveforms,
+        so it is cheap enough to use for sizing the arrays of a sequence before it is made. Args are:
+        1. dt: increment in time
+        """
+        ssb_freq, iqscale, phase, deviation, amp, skew_phase, npulses = self.convert_pulse_params_from_dict()
+        # first increment the sequence by dt if needed
+        with profiler.span('parse'):
+            self.seq = increment_sequence_by_dt(seq=self.seq, dt=dt)
+        with profiler.span('events'):
+            # then create the event table using the sequence
+            self.eventtable = EventTable(self.seq)
+            # fix any pulses that are not long enough for the given deviation
+            self.eventtable.fix_minimum_duration(channel=_WAVE, deviation=deviation)
+            # get the maximum duration of the pulse that has to be inserted, if the Wave keyword is present
+            if self.eventtable.has_channel(_WAVE):
+                max_duration = int(self.eventtable.channel_events(_WAVE)['duration'].max())
+                self.eventtable.insert_pulse_train(channel=_WAVE, duration=max_duration, n=(npulses - 1))
+            # now we need to find the data length i.e. the largest stop time in the list of stop times
+            self.maxend = self.eventtable.max_event()
+        return self.maxend
+
     def create_sequence(self, dt=0):
         """Creates the data for the sequence, with args:
         1. dt: increment in time
         """
+        self.create_events(dt)
+        self.create_waves()
+        self.create_markers()
+
+    def wave_inputs(self):
+        """returns everything other than the event table that the waves depend on, i.e. the pulse params and the
+        files of any Load Wfm pulses"""
+        ssb_freq, iqscale, phase, deviation, amp, skew_phase, npulses = self.convert_pulse_params_from_dict()
+        filenames = [str(self.seq[line][4]) for (ptype, line) in
+                     self.eventtable.channel_events(_WAVE)[['ptype', 'line']].tolist()
+                     if self.eventtable.pulsetypes[ptype] == 'Load Wfm']
+        return (ssb_freq, iqscale, phase, deviation, amp, skew_phase, filenames)
+
+    def create_waves(self):
+        """Creates the I and Q data of the Wave rows of the event table made by create_events"""
+        with profiler.span('pulses', 2 * _IQTYPE.itemsize * self.maxend):
+            self.make_waves()
+
+    def make_waves(self):
+        waveI = np.zeros(self.maxend, dtype=_IQTYPE)
+        waveQ = waveI.copy()
+        # each row of the event table is visited once, in order of channel and start time
+        for (num, (cid, start, stop, duration, ptype, line)) in enumerate(self.eventtable.events.tolist(), 1):
+            cname = self.eventtable.channels[cid]
+            if cname == _WAVE:
+                pulsetype = self.eventtable.pulsetypes[ptype]
+                channel = self.make_pulse(num, start, duration, pulsetype, line)
+                channel.data_generator()
+                # update teh waveI and waveQ arrays
+                waveI[start:stop] = channel.I_data
+                waveQ[start:stop] = channel.Q_data
+                self.logger.info("The pulse type is %s, number is %d, center is %d", pulsetype, channel.num,
+                                 start + channel.mean)
+        # the wavedata will store the data for the I and Q channels in a 2D array
+        self.wavedata = np.array((waveI, waveQ))
+
+    def make_pulse(self, num, start, duration, pulsetype, line):
+        """returns the Pulse object of a Wave row of the event table, with args:
+        1. num: number of the row
+        2. start: start of the pulse, the SSB carrier phase follows the absolute time of the pulse
+        3. duration: width of the pulse
+        4. pulsetype: one of Gauss, Sech, Square, Lorentz or Load Wfm
+        5. line: line of the sequence the row came from
+        """
+        ssb_freq, iqscale, phase, deviation, amp, skew_phase, npulses = self.convert_pulse_params_from_dict()
+        if pulsetype == 'Gauss':
+            channel = Gaussian(num, duration, ssb_freq, iqscale, phase, deviation, amp, skew_phase)
+        elif pulsetype == 'Sech':
+            channel = Sech(num, duration, ssb_freq, iqscale, phase, deviation, amp, skew_phase)
+        elif pulsetype == 'Square':
+            channel = Square(num, duration, ssb_freq, iqscale, phase, amp, skew_phase)
+        elif pulsetype == 'Lorentz':
+            channel = Lorentzian(num, duration, ssb_freq, iqscale, phase, deviation, amp, skew_phase)
+        elif pulsetype == 'Load Wfm':
+            # TODO: Must also figure out how to send that filename to this point
+            filename = self.seq[line][4]  # i will pass the filename in the last element of the list
+            channel = LoadWave(filename, num, duration, ssb_freq, iqscale, phase, amp, deviation,
+                               skew_phase)
+        else:
+            self.logger.error('Pulse type has to be either Gauss, Sech, Square, Lorentz, or Load Wfm')
+            raise ValueError('Pulse type has to be either Gauss, Sech, Square, Lorentz, or Load Wfm')
+        channel.start = start
+        return channel
+
+    def create_markers(self):
+        """Creates the marker data of the marker rows of the event table made by create_events"""
+        with profiler.span('markers', 2 * _MARKTYPE.itemsize * self.maxend):
+            self.make_markers()
+
+    def make_markers(self):
         # get the AOM delay
         aomdelay = int((self.delay[0] + self.timeres / 2) / self.timeres)  # proper way of rounding delay[0]/timeres
         self.logger.info("AOM delay is found to be %d", aomdelay)
         # get the MW delay
         mwdelay = int((self.delay[1] + self.timeres / 2) // self.timeres)
         self.logger.info("MW delay is found to be %d", mwdelay)
-        # get all the pulse params
-        ssb_freq, iqscale, phase, deviation, amp, skew_phase, npulses = self.convert_pulse_params_from_dict()
-        # self.logger.info("The SB freq is %f GHz", ssb_freq)
-        # first increment the sequence by dt if needed
-        self.seq = increment_sequence_by_dt(seq=self.seq, dt=dt)
-        #print('the new sequence after increment is',self.seq)
-        # then create the event dictionary using the sequence
-        self.event_dict = create_event_dictionary(self.seq)
-        #print("The original event dictionary is {}".format(self.event_dict))
-        # fix any pulses that are not long enough for the given deviation
-        self.event_dict = fix_minimum_duration(event_dict=self.event_dict, channel=_WAVE, deviation=deviation)
-        #print("The new event dictionary with after fixing min duration is {}".format(self.event_dict))
-        # get the maximum duration of the pulse that has to be inserted, if the Wave keyword is present
-        if _WAVE in self.event_dict.keys():
-            max_duration = max([self.event_dict[_WAVE][j][2] for j in range(len(self.event_dict[_WAVE]))])
-            #print('max duration of the pulse to be inserted is {}'.format(max_duration))
-            self.event_dict = insert_multiple_pulses_into_event_dictionary(evt_dict=self.event_dict,
-                                                                           pulse=[_WAVE, 0, max_duration], n=(npulses-1))
-        #print("The event dictionary after inserting {} pulses is {}".format(npulses,self.event_dict))
-        # now we need to find the data length i.e. the largest stop time in the list of stop times
-        self.maxend = find_max_event(self.event_dict)
-        #print("the max. event value is {}".format(self.maxend))
-        # now we can init the arrays
-        c1m1 = np.zeros(self.maxend, dtype=_MARKTYPE)
-        c1m2 = c1m1.copy()
-        c2m1 = c1m1.copy()
-        c2m2 = c1m1.copy()
-        waveI = np.zeros(self.maxend, dtype=_IQTYPE)
-        waveQ = waveI.copy()
-        num = 0
-        for pulse in self.seq:
-            # channel = channeldic[pulse[0]]
-            num = num + 1
-            cname = pulse[0]
-            # get all the start,stop,duration point lists
-            start_list = [self.event_dict[cname][j][0] for j in range(len(self.event_dict[cname]))]
-            stop_list = [self.event_dict[cname][j][1] for j in range(len(self.event_dict[cname]))]
-            dur_list = [self.event_dict[cname][j][2] for j in range(len(self.event_dict[cname]))]
-            for j in range(len(start_list)):
-                if cname == _WAVE:
-                    num = num + j
-                    if pulse[3] == 'Gauss':
-                        channel = Gaussian(num, dur_list[j], ssb_freq, iqscale, phase, deviation, amp, skew_phase)
-                    elif pulse[3] == 'Sech':
-                        channel = Sech(num, dur_list[j], ssb_freq, iqscale, phase, deviation, amp, skew_phase)
-                    elif pulse[3] == 'Square':
-                        channel = Square(num, dur_list[j], ssb_freq, iqscale, phase, amp, skew_phase)
-                    elif pulse[3] == 'Lorentz':
-                        channel = Lorentzian(num, dur_list[j], ssb_freq, iqscale, phase, deviation, amp, skew_phase)
-                    elif pulse[3] == 'Load Wfm':
-                        # TODO: Must also figure out how to send that filename to this point
-                        filename = pulse[4]  # i will pass the filename in the last element of the list
-                        channel = LoadWave(filename, num, dur_list[j], ssb_freq, iqscale, phase, deviation, amp,
-                                           skew_phase)
-                    else:
-                        self.logger.error('Pulse type has to be either Gauss, Sech, Square, Lorentz, or Load Wfm')
-                        raise ValueError('Pulse type has to be either Gauss, Sech, Square, Lorentz, or Load Wfm')
-                    channel.data_generator()
-                    # update teh waveI and waveQ arrays
-                    waveI[start_list[j]:stop_list[j]] = channel.I_data
-                    waveQ[start_list[j]:stop_list[j]] = channel.Q_data
-                    self.logger.info("The pulse type is %s, number is %d, center is %d", pulse[3], channel.num,
-                                     start_list[j] + channel.mean)
-                elif (cname == _MW_S2 or cname == _MW_S1):
-                    num = num + j
-                    if cname == _MW_S2:
-                        # print("The marker start is %d stop is %d and type is %s", start, stop, channelname)
-                        self.logger.info("The marker start is %d stop is %d and type is %s", start_list[j],
-                                         stop_list[j], cname)
-                        # this is the only microwave switch connected right now
-                        channel = Marker(num, width=self.maxend, markernum=self.connectiondict[_MW_S2],
-                                         marker_on=start_list[j],
-                                         marker_off=stop_list[j])
-                        channel.data_generator()
-                        # handle the mw delay
-                        c1m1 = c1m1 + np.roll(channel.data, -mwdelay)
-                    elif cname == _MW_S1:
-                        # markernum = 2  # uncomment this line if you want MW S1
-                        self.logger.error('Value error: only MW switch connected is S2 using Ch1, M1')
-                        raise ValueError
-                elif (cname == _GREEN_AOM):
-                    num = num + j
-                    self.logger.info("The marker start is %d stop is %d and type is %s", start_list[j], stop_list[j],
-                                     cname)
-                    channel = Marker(num, width=self.maxend, markernum=self.connectiondict[_GREEN_AOM], marker_on=
-                    start_list[j], marker_off=stop_list[j])
-                    channel.data_generator()
-                    # handle AOM delay
-                    c1m2 = c1m2 + np.roll(channel.data, -aomdelay)
-                elif (cname == _ADWIN_TRIG):
-                    num = num + j
-                    self.logger.info("The marker start is %d stop is %d and type is %s", start_list[j], stop_list[j],
-                                     cname)
-                    channel = Marker(num, width=self.maxend, markernum=self.connectiondict[_ADWIN_TRIG], marker_on=
-                    start_list[j], marker_off=stop_list[j])
-                    channel.data_generator()
-                    c2m2 = c2m2 + channel.data
-        # the marker data is simply the sum of the 2 markers since 1st bit represents m1 and 2nd bit represents m2
-        # for each channel, and that's how we coded the Marker pulse class
-        self.c1markerdata = c1m1 + c1m2
-        self.c2markerdata = c2m1 + c2m2
-        # the wavedata will store the data for the I and Q channels in a 2D array
-        self.wavedata = np.array((waveI, waveQ))
+        # the markers of each AWG channel are painted into one byte array per channel
+        markerdata = (np.zeros(self.maxend, dtype=_MARKTYPE), np.zeros(self.maxend, dtype=_MARKTYPE))
+        for (cid, start, stop, duration, ptype, line) in self.eventtable.events.tolist():
+            cname = self.eventtable.channels[cid]
+            if (cname == _MW_S2 or cname == _MW_S1):
+                if cname == _MW_S2:
+                    self.logger.info("The marker start is %d stop is %d and type is %s", start, stop, cname)
+                    # this is the only microwave switch connected right now, handle the mw delay
+                    self.paint_connected_marker(markerdata, _MW_S2, start, stop, delay=mwdelay)
+                elif cname == _MW_S1:
+                    # markernum = 2  # uncomment this line if you want MW S1
+                    self.logger.error('Value error: only MW switch connected is S2 using Ch1, M1')
+                    raise ValueError
+            elif (cname == _GREEN_AOM):
+                self.logger.info("The marker start is %d stop is %d and type is %s", start, stop, cname)
+                # handle AOM delay
+                self.paint_connected_marker(markerdata, _GREEN_AOM, start, stop, delay=aomdelay)
+            elif (cname == _ADWIN_TRIG):
+                self.logger.info("The marker start is %d stop is %d and type is %s", start, stop, cname)
+                self.paint_connected_marker(markerdata, _ADWIN_TRIG, start, stop)
+        # bit 0 of each marker byte is marker 1 and bit 1 is marker 2 of that channel
+        self.c1markerdata, self.c2markerdata = markerdata
+
+    def paint_connected_marker(self, markerdata, cname, start, stop, delay=0):
+        """paints the event into the marker that the device cname is connected to in the connectiondict. A device
+        that is not connected, i.e. None, sets no marker bits"""
+        markernum = self.connectiondict[cname]
+        if markernum is None:
+            return
+        awgchannel, bit = _MARKER_BITS[markernum]
+        paint_marker(markerdata[awgchannel], start, stop, bit, delay=delay)
+
+
+def step_arrays(buf, length):
+    """Helper method returns the (wavedata, c1markerdata, c2markerdata) arrays of one step laid out in a buffer of
+    _STEP_BYTES * length bytes, such as the shared memory used by the parallel SequenceList"""
+    wavedata = np.ndarray((2, length), dtype=_IQTYPE, buffer=buf)
+    c1markerdata = np.ndarray(length, dtype=_MARKTYPE, buffer=buf, offset=wavedata.nbytes)
+    c2markerdata = np.ndarray(length, dtype=_MARKTYPE, buffer=buf, offset=wavedata.nbytes + length)
+    return (wavedata, c1markerdata, c2markerdata)
+
+
+def compile_step_into_shared_memory(args):
+    """Worker used by SequenceList.create_sequence_list to compile one step in another process. The arrays are copied
+    into the shared memory block the parent made for the step, so only the data length is sent back."""
+    (seq, delay, pulseparams, connectiondict, timeres, shmname, length) = args
+    s = Sequence(seq, delay=delay, pulseparams=pulseparams, connectiondict=connectiondict, timeres=timeres)
+    s.create_sequence(dt=0)
+    if s.maxend != length:
+        raise RuntimeError('Step compiled to {0} samples instead of the {1} planned'.format(s.maxend, length))
+    block = shared_memory.SharedMemory(name=shmname)
+    try:
+        wavedata, c1markerdata, c2markerdata = step_arrays(block.buf, length)
+        wavedata[:] = s.wavedata
+        c1markerdata[:] = s.c1markerdata
+        c2markerdata[:] = s.c2markerdata
+        del wavedata, c1markerdata, c2markerdata  # release the views before closing the block
+    finally:
+        block.close()
+    return length
 
 
 class SequenceList(object):
@@ -522,43 +540,175 @@ class SequenceList(object):
         self.connectiondict = connectiondict
         self.timeres = timeres
         self.sequence = sequence
+        # compile the start and stop fields once, time scans evaluate them for all the steps in one go
+        self.timing = SequenceTiming(sequence)
         self.sequencelist = []
-
-    def create_sequence_list(self):
-        #dt = float(self.scanparams['stepsize'])
-        if self.scanparams['type'] == 'no scan':
-            s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams, \
-                         connectiondict=self.connectiondict, timeres=self.timeres)
-            s.create_sequence(dt=0)
-            self.sequencelist.append(s)
-        else:
+        self.logger = logging.getLogger('seqlogger.seqlist_class')
+
+    def chunk(self, first, stop):
+        """returns a SequenceList with only the steps first to stop of this scan, this is used to run a scan that is too
+        large for the AWG in chunks"""
+        chunk = copy.copy(self)
+        chunk.scanlist = self.scanlist[first:stop]
+        chunk.sequencelist = self.sequencelist[first:stop]
+        return chunk
+
+    def new_sequence(self, seq, pulseparams):
+        return Sequence(seq, delay=self.delay, pulseparams=pulseparams, connectiondict=self.connectiondict,
+                        timeres=self.timeres)
+
+    def step_sequences(self):
+        """returns a list with the (sequence, pulseparams) of each step of the scan. Time scans resolve the start and
+        stop times of every step at once, and the other scans give each step its own copy of the pulse params."""
+        with profiler.span('parse'):
+            return self.make_step_sequences()
+
+    def make_step_sequences(self):
+        scantype = self.scanparams['type']
+        if scantype == 'no scan':
+            return [(self.sequence, self.pulseparams)]
+        elif scantype == 'time':
+            steptimes = self.timing.evaluate_scan(self.scanlist)
+            return [(self.timing.resolve(self.sequence, times), self.pulseparams) for times in steptimes]
+        elif scantype in _SCAN_PARAMS:
+            steps = []
             for x in self.scanlist:
-                if self.scanparams['type'] == 'time':
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(int(x))
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'amplitude':
-                    self.pulseparams['amplitude'] = x
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'SB freq':
-                    self.pulseparams['SB freq'] = x
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'pulsewidth':
-                    self.pulseparams['pulsewidth'] = x
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams,
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
-                    self.sequencelist.append(s)
-                elif self.scanparams['type'] == 'number':
-                    self.pulseparams['num pulses'] = int(x)+1
-                    s = Sequence(self.sequence, delay=self.delay, pulseparams=self.pulseparams, \
-                                 connectiondict=self.connectiondict, timeres=self.timeres)
-                    s.create_sequence(dt=0)
+                params = dict(self.pulseparams)
+                params[_SCAN_PARAMS[scantype]] = int(x) + 1 if scantype == 'number' else x
+                steps.append((self.sequence, params))
+            return steps
+        else:
+            return []
+
+    def create_sequence_list(self, workers=None, delta=True, crosscheck=False, batch=True):
+        """Creates the sequences of all the steps in the scan, with args:
+        1. workers: number of processes used to compile the steps in parallel. The default of None compiles them one
+        after another in this process.
+        2. delta: compile the first step in full and derive the other steps from it, see derive_step.
+        3. crosscheck: also compile each derived step in full and raise a RuntimeError if the data is not the same.
+        4. batch: make all the steps of an amplitude, SB freq or pulsewidth scan at once, see create_batch.
+        """
+        steps = self.step_sequences()
+        if workers is not None and workers > 1 and len(steps) > 1:
+            self.create_parallel(steps, workers)
+            return
+        if batch and self.scanparams['type'] in _BATCH_SCANS and len(steps) > 1:
+            sequences = self.create_batch(steps)
+            if sequences is not None:
+                for (s, (seq, params)) in zip(sequences, steps):
+                    if crosscheck:
+                        self.check_step(s, seq, params)
                     self.sequencelist.append(s)
+                return
+        self.sequencelist.extend(self.iter_sequences(delta=delta, crosscheck=crosscheck, steps=steps))
+
+    def iter_sequences(self, delta=True, crosscheck=False, steps=None):
+        """Generator that compiles the steps of the scan one at a time and yields each Sequence, without storing them
+        in the sequencelist. Only the base step used for the delta compile is kept, so the memory used does not grow
+        with the number of steps. The args delta and crosscheck are the same as for create_sequence_list"""
+        if steps is None:
+            steps = self.step_sequences()
+        base = None
+        for (seq, params) in steps:
+            if delta and base is not None:
+                s = self.derive_step(base, seq, params)
+                if crosscheck:
+                    self.check_step(s, seq, params)
+            else:
+                s = self.new_sequence(seq, params)
+                s.create_sequence(dt=0)
+                base = s
+            yield s
+
+    def create_batch(self, steps):
+        """makes all the steps of a scan that leaves the timing unchanged in one go and returns their sequences, or None
+        if the event tables of the steps are not all the same, e.g. when a longer pulsewidth makes the Wave rows longer.
+        The markers are made once and shared by all the steps. The waves of all the steps are one (steps, 2, points)
+        array: for each Wave row the envelopes of the steps, taken from the envelope cache, are stacked and multiplied
+        by their carriers in a single broadcast, and the wavedata of each step is a view of this array."""
+        sequences = [self.new_sequence(seq, params) for (seq, params) in steps]
+        for s in sequences:
+            s.create_events(dt=0)
+        base = sequences[0]
+        for s in sequences[1:]:
+            if s.maxend != base.maxend or not s.eventtable.same_events(base.eventtable, base.eventtable.channels):
+                return None
+        if 'Load Wfm' in base.eventtable.pulsetypes:
+            return None  # read errors of the wave files are only logged by LoadWave, so leave those to create_waves
+        base.create_markers()
+        with profiler.span('pulses', 2 * _IQTYPE.itemsize * base.maxend * len(sequences)):
+            wavedata = self.make_batch_waves(sequences)
+        for (step, s) in enumerate(sequences):
+            s.wavedata = wavedata[step]
+            s.c1markerdata, s.c2markerdata = base.c1markerdata, base.c2markerdata
+        return sequences
+
+    def make_batch_waves(self, sequences):
+        """returns the (steps, 2, points) array of the waves of all the steps made by create_batch"""
+        base = sequences[0]
+        wavedata = np.zeros((len(sequences), 2, base.maxend), dtype=_IQTYPE)
+        for (num, (cid, start, stop, duration, ptype, line)) in enumerate(base.eventtable.events.tolist(), 1):
+            if base.eventtable.channels[cid] == _WAVE:
+                pulsetype = base.eventtable.pulsetypes[ptype]
+                pulses = [s.make_pulse(num, start, duration, pulsetype, line) for s in sequences]
+                envelopes = np.array([pulse.cached_envelope() for pulse in pulses])
+                if len(set(pulse.carrier_key() for pulse in pulses)) == 1:
+                    icarrier, qcarrier = pulses[0].carriers()
+                else:
+                    carriers = [pulse.carriers() for pulse in pulses]
+                    icarrier = np.array([c[0] for c in carriers])
+                    qcarrier = np.array([c[1] for c in carriers])
+                wavedata[:, 0, start:stop] = envelopes * icarrier
+                wavedata[:, 1, start:stop] = envelopes * qcarrier
+                self.logger.info("The pulse type is %s, number is %d for %d steps", pulsetype, num, len(pulses))
+        return wavedata
+
+    def derive_step(self, base, seq, params):
+        """makes a step of the scan from the fully compiled base step. The event table of the step is made, which is
+        cheap, and only the parts that changed are made again: an amplitude, SB freq or pulsewidth scan only redoes the
+        waves, and a time or number scan only redoes the waves or markers whose rows moved. The parts that did not
+        change share their arrays with the base step, so treat the data of the steps as read only."""
+        s = self.new_sequence(seq, params)
+        s.create_events(dt=0)
+        samelength = (s.maxend == base.maxend)
+        markers = [name for name in s.eventtable.channels if name != _WAVE]
+        if samelength and s.eventtable.same_events(base.eventtable, markers):
+            s.c1markerdata, s.c2markerdata = base.c1markerdata, base.c2markerdata
+        else:
+            s.create_markers()
+        if samelength and s.wave_inputs() == base.wave_inputs() and s.eventtable.same_events(base.eventtable, [_WAVE]):
+            s.wavedata = base.wavedata
+        else:
+            s.create_waves()
+        return s
+
+    def check_step(self, s, seq, params):
+        """compiles the step in full and checks that the data derived for it is byte identical"""
+        full = self.new_sequence(seq, params)
+        full.create_sequence(dt=0)
+        for name in ('wavedata', 'c1markerdata', 'c2markerdata'):
+            derived, expected = getattr(s, name), getattr(full, name)
+            if derived.dtype != expected.dtype or derived.tobytes() != expected.tobytes():
+                self.logger.error('Derived %s of scan step does not match the full compile', name)
+                raise RuntimeError('Derived {0} of scan step does not match the full compile'.format(name))
+
+    def create_parallel(self, steps, workers):
+        """compiles the steps in a pool of worker processes. The data length of each step is found first from its event
+        table, so that a shared memory block can be made for it, and the workers fill these blocks in place."""
+        sequences = [self.new_sequence(seq, params) for (seq, params) in steps]
+        lengths = [s.create_events(dt=0) for s in sequences]
+        blocks = []
+        try:
+            for length in lengths:
+                blocks.append(shared_memory.SharedMemory(create=True, size=max(1, _STEP_BYTES * length)))
+            args = [(s.seq, s.delay, s.pulseparams, self.connectiondict, self.timeres, block.name, length) for
+                    (s, block, length) in zip(sequences, blocks, lengths)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(compile_step_into_shared_memory, args))
+            for (s, block, length) in zip(sequences, blocks, lengths):
+                s.wavedata, s.c1markerdata, s.c2markerdata = [data.copy() for data in step_arrays(block.buf, length)]
+                self.sequencelist.append(s)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
@@ -0,0 +1 @@
+# benchmarks for the sequence compile and file writing code, these run without the AWG or Qt
@@ -0,0 +1,80 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Times the import of the compile path modules in a fresh interpreter, the way a worker process or a command line
+tool starts up. Each import is run in an empty directory, and the heavy modules it loaded and the files it made there
+are reported as well. Run from the top level directory with
+    python -m Hardware.AWG520.benchmarks.import_bench --output imports.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+_ROOT = Path(__file__).resolve().parents[3]
+_MODULES = ['Hardware.AWG520.Pulse', 'Hardware.AWG520.Sequence', 'Hardware.AWG520.AWG520', 'Hardware.AWG520']
+# modules that the compile path should never need
+_HEAVY = ['matplotlib', 'PyQt5', 'ADwin', 'visa', 'pyvisa']
+# run in the fresh interpreter, prints the import time and the heavy modules that were loaded
+_SCRIPT = """
+import sys, time, json
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+print(json.dumps({{'import_s': t, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module, repeat):
+    """imports the module repeat times, each in a new interpreter started in an empty directory. If the import fails
+    the last line of its error is returned instead of the times"""
+    times = []
+    env = dict(os.environ, PYTHONPATH=str(_ROOT), PYTHONDONTWRITEBYTECODE='1')
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = subprocess.run([sys.executable, '-c', _SCRIPT.format(module=module, heavy=_HEAVY)], cwd=tmp,
+                                 env=env, capture_output=True, text=True)
+            if out.returncode != 0:
+                return {'module': module, 'error': out.stderr.strip().splitlines()[-1]}
+            result = json.loads(out.stdout.splitlines()[-1])
+            times.append(result['import_s'])
+            files = sorted(str(p.relative_to(tmp)) for p in Path(tmp).rglob('*'))
+    return {'module': module, 'min_s': min(times), 'median_s': statistics.median(times), 'repeat': repeat,
+            'heavy': result['heavy'], 'files': files}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time of the compile path modules')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--repeat', type=int, default=5, help='number of imports of each module')
+    args = parser.parse_args()
+    results = [time_import(module, args.repeat) for module in _MODULES]
+    for r in results:
+        if 'error' in r:
+            print('{0:>24s} failed: {1}'.format(r['module'], r['error']))
+            continue
+        print('{0:>24s} {1:10.1f} ms  heavy: {2}  files: {3}'.format(r['module'], 1e3 * r['min_s'],
+                                                                     ', '.join(r['heavy']) or '-',
+                                                                     ', '.join(r['files']) or '-'))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version, 'results': results}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
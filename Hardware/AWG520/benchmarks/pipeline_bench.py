@@ -0,0 +1,179 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Times each stage of the sequence compile and file writing pipeline: Sequence.create_sequence,
+SequenceList.create_sequence_list, AWGFile.binarymaker, AWGFile.write_waveform and AWGFile.write_sequence, over
+sequence lengths, numbers of scan steps, numbers of pulses and pulse shapes. It needs neither the AWG nor Qt. Run from
+the top level directory with
+    python -m Hardware.AWG520.benchmarks.pipeline_bench --output before.json
+and after a change compare the two runs with
+    python -m Hardware.AWG520.benchmarks.pipeline_bench --output after.json --compare before.json
+The caches of the envelopes, carriers and wave files are cleared before every run, so the times are those of a first
+compile. The sequence and AWG loggers are raised to WARNING, so that the times do not include writing the log
+files and the run leaves nothing in the logs directory.
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from Hardware.AWG520.AWG520 import AWGFile
+from Hardware.AWG520.Pulse import envelope_cache, carrier_cache, wavefile_cache
+from Hardware.AWG520.Sequence import Sequence, SequenceList
+
+_WAVEFILE = Path(__file__).resolve().parents[3] / 'arbpulseshape' / 'test4.txt'
+_SHAPES = ['Gauss', 'Sech', 'Square', 'Lorentz', 'Load Wfm']
+_PULSEPARAMS = {'amplitude': 100, 'pulsewidth': 10, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                'skew phase': 0.0, 'num pulses': 1}
+_DELAY = [820, 10]
+
+# the sizes of the full run and of the --quick run, the single pulse runs are the ones over the lengths and shapes
+_SIZES = {'full': {'lengths': [1000, 10000, 100000, 1000000], 'steps': [1, 10, 100, 500],
+                   'pulses': [10, 100, 1000], 'repeat': 5},
+          'quick': {'lengths': [1000, 10000], 'steps': [1, 10], 'pulses': [10], 'repeat': 3}}
+
+
+def clear_caches():
+    envelope_cache.clear()
+    carrier_cache.clear()
+    wavefile_cache.clear()
+
+
+def timed(func, repeat, setup=clear_caches):
+    """runs func repeat times, calling setup before each run, and returns the min and median time in seconds"""
+    times = []
+    for _ in range(repeat):
+        setup()
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    return {'min_s': min(times), 'median_s': statistics.median(times), 'repeat': repeat}
+
+
+def make_sequence(length, shape='Gauss'):
+    """a pulse followed by a readout, the readout is stretched so that the sequence is length samples long"""
+    wave = ['Wave', '1000', '1100', shape]
+    if shape == 'Load Wfm':
+        wave.append(_WAVEFILE)
+    return [['S2', '1000', '1100'], wave, ['Green', '1100', str(max(length, 1200))],
+            ['Measure', '1100', '1400']]
+
+
+def bench_create_sequence(sizes):
+    results = []
+    for length in sizes['lengths']:
+        for shape in _SHAPES:
+            s = Sequence(make_sequence(length, shape), delay=_DELAY, pulseparams=dict(_PULSEPARAMS))
+            results.append(('create_sequence', {'length': length, 'shape': shape, 'pulses': 1},
+                            timed(lambda: s.create_sequence(dt=0), sizes['repeat'])))
+    for npulses in sizes['pulses']:
+        params = dict(_PULSEPARAMS, **{'num pulses': npulses})
+        s = Sequence(make_sequence(10000), delay=_DELAY, pulseparams=params)
+        results.append(('create_sequence', {'length': 10000, 'shape': 'Gauss', 'pulses': npulses},
+                        timed(lambda: s.create_sequence(dt=0), sizes['repeat'])))
+    return results
+
+
+def bench_create_sequence_list(sizes):
+    results = []
+    seq = [['S2', '1000', '1100+t'], ['Wave', '1000', '1100+t', 'Gauss'], ['Green', '1200+t', '4200+t'],
+           ['Measure', '1200+t', '1500+t']]
+    for nsteps in sizes['steps']:
+        for (scantype, start, stepsize) in [('amplitude', 10, 1), ('time', 0, 10), ('SB freq', 0.01, 0.0001),
+                                            ('number', 0, 1)]:
+            scanparams = {'type': scantype, 'start': start, 'stepsize': stepsize, 'steps': nsteps}
+
+            def run():
+                slist = SequenceList(seq, delay=_DELAY, scanparams=scanparams, pulseparams=dict(_PULSEPARAMS))
+                slist.create_sequence_list()
+
+            results.append(('create_sequence_list', {'steps': nsteps, 'type': scantype},
+                            timed(run, sizes['repeat'])))
+    return results
+
+
+def bench_file_writing(sizes, dirpath):
+    results = []
+    (dirpath / 'wfm').mkdir()
+    awgfile = AWGFile(dirpath=dirpath / 'wfm')
+    for length in sizes['lengths']:
+        iqdata = np.array(np.sin(np.linspace(0, 100, length)), dtype=np.float32)
+        marker = np.array(np.arange(length) % 4, dtype=np.int8)
+        results.append(('binarymaker', {'length': length},
+                        timed(lambda: awgfile.binarymaker(iqdata, marker), sizes['repeat'])))
+        for writemode in ['buffered', 'mmap']:
+            awgfile.writemode = writemode
+            results.append(('write_waveform', {'length': length, 'writemode': writemode},
+                            timed(lambda: awgfile.write_waveform('1', 1, iqdata, marker), sizes['repeat'])))
+    seq = [['S2', '1000', '1100'], ['Wave', '1000', '1100', 'Gauss'], ['Green', '1200', '4200'],
+           ['Measure', '1200', '1500']]
+    for nsteps in sizes['steps']:
+        scanparams = {'type': 'amplitude', 'start': 10, 'stepsize': 1, 'steps': nsteps}
+        slist = SequenceList(seq, delay=_DELAY, scanparams=scanparams, pulseparams=dict(_PULSEPARAMS))
+        # each AWGFile gets an empty directory of its own, since it clears the wfm and seq files out of it
+        seqdir = dirpath / 'steps{0}'.format(nsteps)
+        seqdir.mkdir()
+        seqfile = AWGFile(sequencelist=slist, ftype='SEQ', dirpath=seqdir)
+        results.append(('write_sequence', {'steps': nsteps, 'length': 4200},
+                        timed(seqfile.write_sequence, sizes['repeat'], setup=lambda: None)))
+    return results
+
+
+def compare(results, oldfile):
+    """prints the ratio of each time to the time of the same benchmark in an earlier run"""
+    with open(oldfile) as f:
+        old = {(r['bench'], json.dumps(r['params'], sort_keys=True)): r['min_s'] for r in json.load(f)['results']}
+    print('{0:>22s} {1:>50s} {2:>10s} {3:>10s} {4:>7s}'.format('bench', 'params', 'old (ms)', 'new (ms)', 'ratio'))
+    for r in results:
+        key = (r['bench'], json.dumps(r['params'], sort_keys=True))
+        if key in old:
+            print('{0:>22s} {1:>50s} {2:10.3f} {3:10.3f} {4:7.2f}'.format(r['bench'], key[1], 1e3 * old[key],
+                                                                        1e3 * r['min_s'], r['min_s'] / old[key]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the sequence compile and file writing pipeline')
+    parser.add_argument('--output', default='pipeline_bench.json', help='JSON file the results are written to')
+    parser.add_argument('--quick', action='store_true', help='only run the small sizes')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare the results with')
+    args = parser.parse_args()
+    # the loggers of the modules log every pulse at INFO, which would be timed along with the compile
+    for name in ('seqlogger', 'awg520private'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    sizes = _SIZES['quick' if args.quick else 'full']
+    results = []
+    results.extend(bench_create_sequence(sizes))
+    results.extend(bench_create_sequence_list(sizes))
+    with tempfile.TemporaryDirectory() as tmp:
+        results.extend(bench_file_writing(sizes, Path(tmp)))
+    results = [dict(bench=name, params=params, **times) for (name, params, times) in results]
+    meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'sizes': 'quick' if args.quick else 'full'}
+    with open(args.output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+    for r in results:
+        print('{0:>22s} {1:>50s} {2:10.3f} ms'.format(r['bench'], json.dumps(r['params'], sort_keys=True),
+                                                       1e3 * r['min_s']))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Compares the EventTable pulse train scheduler used by Sequence.create_sequence with the deep-copied event
+dictionary helpers it replaced, which are kept below as they were before the EventTable. The old helpers only push
+the events that overlap the inserted pulses, so the two do not give the same schedule when an event starts after the
+last inserted pulse. Run from the top level directory with
+    python -m Hardware.AWG520.benchmarks.scheduler_bench
+"""
+import copy
+import timeit
+from collections import defaultdict
+
+from Hardware.AWG520.Sequence import EventTable
+
+_DURATION = 60  # length of each inserted pulse in samples
+
+
+def sort_event_dictionary(evt_dict):
+    """sorts each channel of the event dictionary by the start time of the pulses"""
+    tmp_dict = copy.deepcopy(evt_dict)
+    for k, v in tmp_dict.items():
+        tmp_dict[k] = sorted(v, key=lambda x: x[0])
+    return dict(tmp_dict)
+
+
+def create_event_dictionary(seq):
+    """creates a dictionary with a key for each channel name, and the values being the (start,stop,duration,pulsetype)
+    tuples of that channel"""
+    event_dict = defaultdict(list)
+    for pulse in seq:
+        start = int(pulse[1])
+        stop = int(pulse[2])
+        event_dict[pulse[0]].append((start, stop, stop - start, pulse[3] if len(pulse) > 3 else ''))
+    return sort_event_dictionary(event_dict)
+
+
+def insert_multiple_pulses_into_event_dictionary(evt_dict, pulse, n=0):
+    """inserts the pulses of the channel denoted by pulse n more times into the event dictionary, and then pushes the
+    pulses of the other channels that conflict with them"""
+    temp_dict = copy.deepcopy(evt_dict)
+    p_channel = str(pulse[0])
+    p_duration = int(pulse[2]) - int(pulse[1])
+    for key, val in evt_dict.items():
+        if p_channel == key:
+            for i in range(n):
+                for (start, stop, duration, ptype) in val:
+                    temp_dict[key].append((start + (i + 1) * p_duration, stop + (i + 1) * p_duration, duration,
+                                           ptype))
+    temp_dict = push_later_pulses(temp_dict, p_channel)
+    return dict(temp_dict)
+
+
+def push_later_pulses(evt_dict, insert_channel):
+    """pushes the pulses that do not belong to the insert channel to later times if their start times fall between
+    the first start time and the last stop time of the insert channel"""
+    temp_dict = copy.deepcopy(evt_dict)
+    earliest_start_time = evt_dict[insert_channel][0][0]
+    latest_start_time = evt_dict[insert_channel][-1][0]
+    latest_stop_time = evt_dict[insert_channel][-1][1]
+    push_time = latest_start_time - earliest_start_time
+    for channel, val in evt_dict.items():
+        if channel != insert_channel:
+            for (idx, (start, stop, duration, ptype)) in enumerate(val):
+                if earliest_start_time < start < latest_stop_time:
+                    temp_dict[channel][idx] = (start + push_time, stop + push_time, duration, ptype)
+    return sort_event_dictionary(temp_dict)
+
+
+def make_sequence(nwaves):
+    """a CPMG/XY-8 like sequence with nwaves pulses on the Wave channel and a readout after the last one"""
+    seq = [['Green', '0', '1000'], ['S2', '1000', str(1000 + 200 * nwaves)]]
+    for k in range(nwaves):
+        seq.append(['Wave', str(1000 + 200 * k), str(1000 + 200 * k + _DURATION), 'Gauss'])
+    seq.append(['Green', str(1100 + 200 * nwaves), str(4100 + 200 * nwaves)])
+    seq.append(['Measure', str(1100 + 200 * nwaves), str(1400 + 200 * nwaves)])
+    return seq
+
+
+def run_legacy(seq, npulses):
+    evt_dict = create_event_dictionary(seq)
+    return insert_multiple_pulses_into_event_dictionary(evt_dict, pulse=['Wave', 0, _DURATION], n=npulses)
+
+
+def run_scheduler(seq, npulses):
+    table = EventTable(seq)
+    table.insert_pulse_train(channel='Wave', duration=_DURATION, n=npulses)
+    return table
+
+
+def bench(nwaves, npulses, repeat=5):
+    seq = make_sequence(nwaves)
+    results = {}
+    for (name, func) in [('legacy', run_legacy), ('scheduler', run_scheduler)]:
+        timer = timeit.Timer(lambda: func(seq, npulses))
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(repeat=repeat, number=number)) / number
+    return results
+
+
+def main():
+    print('{0:>8s} {1:>8s} {2:>12s} {3:>12s}'.format('waves', 'npulses', 'legacy (ms)', 'sched. (ms)'))
+    for nwaves in [1, 8, 64]:
+        for npulses in [1, 100, 1000]:
+            res = bench(nwaves, npulses)
+            print('{0:8d} {1:8d} {2:12.3f} {3:12.3f}'.format(nwaves, npulses, 1e3 * res['legacy'],
+                                                            1e3 * res['scheduler']))
+
+
+if __name__ == '__main__':
+    main()
@@ -57,6 +57,205 @@ def test_awg520_2():
     reply = c.sendcommand('TRG?')
     assert reply == 'TEK' # deliberate fail to show that pytest will flag this
 
+
+def line_server(answer, dropafter=None):
+    """starts a server in this process that reads the commands line by line, sends back answer(line) for the
+    queries and closes the first connection after dropafter lines. Returns the server socket, the list of its
+    connections and the list of the lines it read"""
+    import threading
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind((HOST, 0))
+    server.listen()
+    connections = []
+    lines = []
+
+    def serve():
+        while True:
+            try:
+                client, addr = server.accept()
+            except OSError:
+                return
+            connections.append(client)
+            with client, client.makefile('rb') as reader:
+                for (num, line) in enumerate(reader, 1):
+                    lines.append(line)
+                    if b'?' in line:
+                        client.sendall(answer(line))
+                    if len(connections) == 1 and num == dropafter:
+                        break
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server, connections, lines
+
+
+def test_awg520_keeps_connection():
+    # the server drops the first connection after 3 commands
+    server, connections, lines = line_server(lambda line: b'SONY/TEK,AWG520\n' if line == b'*IDN?\n' else line,
+                                             dropafter=3)
+    c = AWG520(HOST, server.getsockname()[1], readtimeout=2)
+    try:
+        assert c.sendcommand('*IDN?') == 'SONY/TEK,AWG520\n'
+        # the two IDN queries of __init__ and this one all went over one connection, which the server then closed
+        assert len(connections) == 1
+        c.trigger()
+        c.jump(2)
+        assert c.sendcommand('AWGC:EVEN:SOFT?') == 'AWGC:EVEN:SOFT?\n'
+        assert len(connections) == 2
+    finally:
+        c.cleanup()
+        server.close()
+
+
+def test_awg520_setup_is_one_command():
+    server, connections, lines = line_server(lambda line: b'1;0,"No error"\n' if line.endswith(b'ERR?\n') else
+                                             b'SONY/TEK,AWG520\n')
+    c = AWG520(HOST, server.getsockname()[1], readtimeout=2)
+    try:
+        del lines[:]
+        assert c.setup(enableiq=True)
+        assert len(lines) == 1
+        commands = lines[0].decode().strip().split(';')
+        assert commands[0] == ':AWGC:CLOC:SOUR EXT' and commands[1] == ':SOUR1:FUNC:USER "scan.seq","MAIN"'
+        assert commands[-3:] == [':OUTP2:STAT ON', '*OPC?', ':SYST:ERR?']
+        assert c.sendcommands(['*TRG', 'AWGC:EVEN:SOFT 2'], queries=()) is None
+        c.sendcommand('*IDN?')  # the reply shows the server has read the line before it
+        assert lines[-2] == b'*TRG;:AWGC:EVEN:SOFT 2\n'
+    finally:
+        c.cleanup()
+        server.close()
+
+def test_awg520_sends_files_in_one_session(tmp_path, monkeypatch):
+    import sys
+    # the package exports the AWG520 class under the name of its module
+    awg520module = sys.modules['Hardware.AWG520.AWG520']
+    logins = []
+    stored = {}
+    reads = []
+
+    class SessionFTP(object):
+        # records the logins and files of the FTP sessions, the second file stored fails once
+        def connect(self, host, port, timeout=None):
+            pass
+
+        def login(self, user, passwd):
+            logins.append(user)
+
+        def storbinary(self, cmd, fp):
+            if len(stored) == 1 and len(logins) == 1:
+                raise EOFError('connection closed')
+            stored[cmd[len('STOR '):]] = bytes(fp.read())
+            reads.append(type(fp.read()))
+
+        def voidcmd(self, cmd):
+            pass
+
+        def quit(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(awg520module, 'FTP', SessionFTP)
+    server, connections, lines = line_server(lambda line: b'SONY/TEK,AWG520\n')
+    c = AWG520(HOST, server.getsockname()[1], readtimeout=2)
+    files = []
+    for num in range(5):
+        (tmp_path / '{0}_1.wfm'.format(num)).write_bytes(bytes(100 * num))
+        files.append(('{0}_1.wfm'.format(num), tmp_path / '{0}_1.wfm'.format(num)))
+    try:
+        assert c.sendfiles(files) == 1000
+        # one login, and one more after the session failed
+        assert len(logins) == 2
+        assert sorted(stored) == [name for (name, path) in files]
+        assert all(stored[name] == path.read_bytes() for (name, path) in files)
+        assert c.sendfiles([('missing.wfm', tmp_path / 'missing.wfm')]) == -1
+        # buffers are read through memoryviews without going through a file
+        assert c.sendfiles([('memory.wfm', bytearray(b'MAGIC 1000'))]) == 10
+        assert stored['memory.wfm'] == b'MAGIC 1000' and reads[-1] is memoryview
+    finally:
+        c.cleanup()
+        server.close()
+
+def test_awg520_syncs_changed_files(tmp_path, monkeypatch):
+    import sys
+    from ftplib import error_perm
+    awg520module = sys.modules['Hardware.AWG520.AWG520']
+    awgdisk = {'other.wfm': b'old', 'notes.txt': b'kept'}
+    sent = []
+
+    class DiskFTP(object):
+        # the files on the AWG are kept in awgdisk
+        def connect(self, host, port, timeout=None):
+            pass
+
+        def login(self, user, passwd):
+            pass
+
+        def voidcmd(self, cmd):
+            pass
+
+        def nlst(self):
+            return sorted(awgdisk)
+
+        def size(self, filename):
+            if filename not in awgdisk:
+                raise error_perm('550 no such file')
+            return len(awgdisk[filename])
+
+        def delete(self, filename):
+            del awgdisk[filename]
+
+        def storbinary(self, cmd, fp):
+            sent.append(cmd[len('STOR '):])
+            awgdisk[cmd[len('STOR '):]] = bytes(fp.read())
+
+        def quit(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(awg520module, 'FTP', DiskFTP)
+    server, connections, lines = line_server(lambda line: b'SONY/TEK,AWG520\n')
+    manifest = tmp_path / 'manifest.json'
+    files = {'0_1.wfm': b'blank', '1_1.wfm': b'step 1', '2_1.wfm': b'step 2', 'scan.seq': b'seq'}
+    try:
+        c = AWG520(HOST, server.getsockname()[1], readtimeout=2, manifestpath=manifest)
+        assert c.syncfiles(list(files.items())) == sum(len(data) for data in files.values())
+        # the wfm file left over from another scan is removed, other files are not touched
+        assert sorted(awgdisk) == ['0_1.wfm', '1_1.wfm', '2_1.wfm', 'notes.txt', 'scan.seq']
+        c.cleanup()
+        # a new instance reads the manifest and only sends the file that changed
+        del sent[:]
+        files['2_1.wfm'] = b'step 2 with a new time'
+        c = AWG520(HOST, server.getsockname()[1], readtimeout=2, manifestpath=manifest)
+        assert c.syncfiles(list(files.items())) == len(files['2_1.wfm'])
+        assert sent == ['2_1.wfm'] and awgdisk['2_1.wfm'] == files['2_1.wfm']
+        # a file that is no longer on the AWG, or is not the size the manifest says, is sent again
+        del awgdisk['0_1.wfm']
+        awgdisk['1_1.wfm'] = b'changed on the AWG'
+        del sent[:]
+        c.syncfiles(list(files.items()))
+        assert sorted(sent) == ['0_1.wfm', '1_1.wfm'] and awgdisk['1_1.wfm'] == files['1_1.wfm']
+        assert c.remove_selected_awg_files('*.wfm') == ['0_1.wfm', '1_1.wfm', '2_1.wfm']
+        assert c.remove_all_awg_files() == ['notes.txt', 'scan.seq'] and awgdisk == {}
+    finally:
+        c.cleanup()
+        server.close()
+
+def test_memory_reader_releases_buffer():
+    import io
+    from Hardware.AWG520.AWG520 import MemoryReader
+    buffer = io.BytesIO(b'MAGIC 1000')
+    with buffer.getbuffer() as view, MemoryReader(view) as reader:
+        head = reader.read(5)
+        rest = reader.read()
+        assert bytes(head) + bytes(rest) == b'MAGIC 1000'
+    # the views that were read are released with the reader, so the buffer can grow although they are still referenced
+    buffer.seek(0, 2)
+    buffer.write(b' more')
+    assert buffer.getvalue() == b'MAGIC 1000 more'
+
 # when pytest is run with the '-m run_this' flag this test will not be executed
 def test_awgfile():
     d = AWGFile(ftype="SEQ")
@@ -36,7 +36,9 @@ def handle_connection(client,addr):
             return 'Data'
 
 
-# this server simulates the AWG command protocol, simply echoing the command back except for IDN?
+# this server simulates the AWG command protocol, the AWG520 class keeps its connection open so each connection can
+# carry many commands. Queries are answered, IDN? with the AWG model and any other by echoing it back, and commands
+# are not answered, the same as the AWG
 p_pid = os.getpid()
 print('Starting echo server with process id:{0}'.format(p_pid))
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -49,16 +51,18 @@ with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             client, addr = s.accept()
             #handle_connection(client,addr)
             with client:
-                #client.send(b'Connected by', addr)
-                # print("Got connection")
-                data = client.recv(1024)
-                if not data:
-                    break
-                elif (data == b'*IDN?\n'):
-                    #print('SONY/TEK,AWG520,0,SCPI:95.0 OS:3.0 USR:4.0\n')
-                    client.sendall(b'SONY/TEK,AWG520,0,SCPI:95.0 OS:3.0 USR:4.0\n')
-                else:
-                    client.sendall(data)
+                while True:
+                    data = client.recv(1024)
+                    if not data:
+                        break
+                    elif (data == b'*IDN?\n'):
+                        #print('SONY/TEK,AWG520,0,SCPI:95.0 OS:3.0 USR:4.0\n')
+                        client.sendall(b'SONY/TEK,AWG520,0,SCPI:95.0 OS:3.0 USR:4.0\n')
+                    elif data.endswith(b'*OPC?;:SYST:ERR?\n'):
+                        # the end of a batch of commands sent by AWG520.sendcommands
+                        client.sendall(b'1;0,"No error"\n')
+                    elif b'?' in data or not data.endswith(b'\n'):
+                        client.sendall(data)
     finally:
         time.sleep(1)
         print('Exiting echo server:'.format(p_pid))
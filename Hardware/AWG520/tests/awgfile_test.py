@@ -0,0 +1,215 @@
+# tests for writing the AWG520 waveform and sequence files, these do not need the AWG or the dummy servers
+import pytest
+import struct
+import numpy as np
+from Hardware.AWG520.AWG520 import AWGFile, ScanPlan, run_length_segments, expand_segments
+
+
+def make_data(wfmlen=1001):
+    iqdata = np.array(np.sin(np.linspace(0, 20, wfmlen)), dtype=np.float32)
+    marker = np.array(np.arange(wfmlen) % 4, dtype=np.int8)
+    return iqdata, marker
+
+
+def test_binarymaker_matches_struct(tmp_path):
+    f = AWGFile(dirpath=tmp_path)
+    iqdata, marker = make_data()
+    numbytes, recordsize, record = f.binarymaker(iqdata, marker)
+    expected = b''.join([struct.pack('<fb', iqdata[i], marker[i]) for i in range(len(iqdata))])
+    assert recordsize == struct.calcsize('<fb')
+    assert numbytes == len(expected)
+    assert bytes(record) == expected
+
+
+def test_binarymaker_length_mismatch(tmp_path):
+    f = AWGFile(dirpath=tmp_path)
+    iqdata, marker = make_data()
+    assert f.binarymaker(iqdata, marker[:-1]) == (None, None, None)
+
+
+def test_mmap_writer_matches_buffered(tmp_path):
+    iqdata, marker = make_data()
+    (tmp_path / 'buffered').mkdir()
+    (tmp_path / 'mmap').mkdir()
+    fb = AWGFile(dirpath=tmp_path / 'buffered')
+    fm = AWGFile(dirpath=tmp_path / 'mmap', writemode='mmap')
+    fb.write_waveform('1', 1, iqdata, marker)
+    fm.write_waveform('1', 1, iqdata, marker)
+    assert (tmp_path / 'mmap' / '1_1.wfm').read_bytes() == (tmp_path / 'buffered' / '1_1.wfm').read_bytes()
+
+
+def test_parallel_write_sequence_matches_serial(tmp_path):
+    from Hardware.AWG520.Sequence import SequenceList
+    seq = [['S2', '1000', '1400'], ['Wave', '1000', '1400', 'Gauss'], ['Green', '1400', '3400']]
+    scanparams = {'type': 'amplitude', 'start': 0, 'stepsize': 100, 'steps': 3}
+    pulseparams = {'amplitude': 100, 'pulsewidth': 50, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                   'skew phase': 0.0, 'num pulses': 1}
+    (tmp_path / 'serial').mkdir()
+    (tmp_path / 'parallel').mkdir()
+    for (name, workers) in [('serial', None), ('parallel', 2)]:
+        slist = SequenceList(seq, delay=[820, 10], pulseparams=dict(pulseparams), scanparams=scanparams)
+        f = AWGFile(sequencelist=slist, ftype='SEQ', dirpath=tmp_path / name, workers=workers)
+        f.write_sequence()
+    serialfiles = sorted(p.name for p in (tmp_path / 'serial').iterdir())
+    assert serialfiles == sorted(p.name for p in (tmp_path / 'parallel').iterdir())
+    for name in serialfiles:
+        assert (tmp_path / 'serial' / name).read_bytes() == (tmp_path / 'parallel' / name).read_bytes()
+
+
+def test_streamed_write_sequence_matches_compiled(tmp_path):
+    from Hardware.AWG520.Sequence import SequenceList
+    seq = [['S2', '1000', '1400'], ['Wave', '1000', '1000+t', 'Sech'], ['Green', '1400', '3400']]
+    scanparams = {'type': 'time', 'start': 20, 'stepsize': 20, 'steps': 4}
+    pulseparams = {'amplitude': 100, 'pulsewidth': 10, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                   'skew phase': 0.0, 'num pulses': 1}
+    (tmp_path / 'compiled').mkdir()
+    (tmp_path / 'streamed').mkdir()
+    for (name, stream) in [('compiled', False), ('streamed', True)]:
+        slist = SequenceList(seq, delay=[820, 10], pulseparams=dict(pulseparams), scanparams=scanparams)
+        f = AWGFile(sequencelist=slist, ftype='SEQ', dirpath=tmp_path / name, stream=stream)
+        f.write_sequence()
+        # the streamed steps are never kept in the sequence list
+        assert len(slist.sequencelist) == (0 if stream else 4)
+    compiledfiles = sorted(p.name for p in (tmp_path / 'compiled').iterdir())
+    assert compiledfiles == sorted(p.name for p in (tmp_path / 'streamed').iterdir())
+    for name in compiledfiles:
+        assert (tmp_path / 'compiled' / name).read_bytes() == (tmp_path / 'streamed' / name).read_bytes()
+
+
+def test_write_sequence_dedups_identical_waveforms(tmp_path):
+    from Hardware.AWG520.Sequence import SequenceList
+    # only the S2 marker on channel 1 moves, so channel 2 is the same for every step
+    seq = [['S2', '1000', '1200+t'], ['Wave', '1000', '1200', 'Gauss'], ['Measure', '1400', '1700']]
+    scanparams = {'type': 'time', 'start': 0, 'stepsize': 50, 'steps': 3}
+    pulseparams = {'amplitude': 100, 'pulsewidth': 50, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                   'skew phase': 0.0, 'num pulses': 1}
+    for (name, workers) in [('serial', None), ('parallel', 2)]:
+        (tmp_path / name).mkdir()
+        slist = SequenceList(seq, delay=[820, 10], pulseparams=dict(pulseparams), scanparams=scanparams)
+        f = AWGFile(sequencelist=slist, ftype='SEQ', dirpath=tmp_path / name, workers=workers)
+        f.write_sequence()
+        assert sorted(p.name for p in (tmp_path / name).iterdir()) == ['0_1.wfm', '0_2.wfm', '1_1.wfm', '1_2.wfm',
+                                                                       '2_1.wfm', '3_1.wfm', 'scan.seq']
+        lines = (tmp_path / name / 'scan.seq').read_text().splitlines()
+        assert lines[3:6] == ['"1_1.wfm","1_2.wfm",50000,1,0,0', '"2_1.wfm","1_2.wfm",50000,1,0,0',
+                              '"3_1.wfm","1_2.wfm",50000,1,0,0']
+
+
+def test_run_length_segments():
+    wfmlen = 256 * 20 + 100
+    wavedata = np.zeros((2, wfmlen), dtype=np.float32)
+    c1marker = np.zeros(wfmlen, dtype=np.int8)
+    c2marker = np.zeros(wfmlen, dtype=np.int8)
+    wavedata[:, 300:700] = np.sin(np.arange(400))  # a pulse in blocks 1 and 2
+    c1marker[1000:4200] = 2  # a long marker that covers blocks 4 to 15
+    wavedata[1, 4500] = -0.0  # the same float as 0.0 but not the same waveform
+    segments = run_length_segments(wavedata, c1marker, c2marker)
+    for data in (wavedata[0], wavedata[1], c1marker, c2marker):
+        assert expand_segments(data, segments).tobytes() == data.tobytes()
+    assert all(stop - start >= 256 for (start, stop, repeat) in segments)
+    assert (1024, 1280, 12) in segments  # blocks 4 to 15 are stored once
+    assert sum(stop - start for (start, stop, repeat) in segments) < wfmlen // 2
+
+
+def test_compressed_write_sequence(tmp_path):
+    from Hardware.AWG520.Sequence import SequenceList
+    # a long readout window that is constant for most of its length
+    seq = [['S2', '1000', '1400'], ['Wave', '1000', '1000+t', 'Sech'], ['Green', '1400', '1201400']]
+    scanparams = {'type': 'time', 'start': 20, 'stepsize': 20, 'steps': 2}
+    pulseparams = {'amplitude': 100, 'pulsewidth': 10, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                   'skew phase': 0.0, 'num pulses': 1}
+    slist = SequenceList(seq, delay=[820, 10], pulseparams=dict(pulseparams), scanparams=scanparams)
+    f = AWGFile(sequencelist=slist, ftype='SEQ', dirpath=tmp_path, compress=True)
+    f.write_sequence()
+    lines = (tmp_path / 'scan.seq').read_text().splitlines()
+    assert lines[1] == 'LINES ' + str(len(lines) - 3)
+    # each step waits for the trigger on its first line and its last line loops back to its second line
+    first, second = f.steplines
+    assert lines[first + 1].split(',')[3] == '1'
+    assert lines[second].split(',')[4] == str(first + 1)
+    assert lines[second].split(',')[:2] == lines[first + 1].split(',')[:2]
+    # the steps together take far less than the 1.2 million points of a single step
+    assert sum(p.stat().st_size for p in tmp_path.glob('*.wfm')) < 5 * 1201400 / 4
+
+
+def test_scan_plan_chunks():
+    from Hardware.AWG520.Sequence import SequenceList
+    seq = [['S2', '1000', '1400'], ['Wave', '1000', '1000+t', 'Gauss'], ['Green', '1400', '3400+t']]
+    scanparams = {'type': 'time', 'start': 0, 'stepsize': 100, 'steps': 10}
+    pulseparams = {'amplitude': 100, 'pulsewidth': 10, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                   'skew phase': 0.0, 'num pulses': 1}
+    slist = SequenceList(seq, delay=[820, 10], pulseparams=pulseparams, scanparams=scanparams)
+    assert ScanPlan(slist).chunks == [(0, 10)]
+    # the steps are 3400 to 4300 points long, so about 3 steps fit in 12000 points with the empty waveform
+    plan = ScanPlan(slist, memorylimit=12000)
+    assert plan.steplengths == [3400 + 100 * i for i in range(10)]
+    assert plan.chunks[0] == (0, 2) and plan.chunks[-1][1] == 10
+    chunks = plan.chunk_sequences()
+    assert [len(c.scanlist) for c in chunks] == [stop - first for (first, stop) in plan.chunks]
+    for (first, stop) in plan.chunks:
+        assert plan.steplengths[first] + sum(plan.steplengths[first:stop]) <= 12000
+    # the steps of the chunks are the same as the steps of the whole scan
+    steps = slist.step_sequences()
+    assert [step for c in chunks for step in c.step_sequences()] == steps
+    with pytest.raises(ValueError):
+        ScanPlan(slist, memorylimit=5000)
+    with pytest.raises(ValueError):
+        ScanPlan(slist, linelimit=1)
+
+
+def test_scan_plan_long_steps():
+    from Hardware.AWG520.Sequence import SequenceList
+    seq = [['S2', '1000', '1400'], ['Green', '1400', '2000000']]
+    slist = SequenceList(seq, delay=[820, 10], scanparams={'type': 'no scan', 'start': 0, 'stepsize': 1, 'steps': 1})
+    # a step longer than a waveform fails before anything is compiled, unless it will be compressed
+    with pytest.raises(ValueError):
+        ScanPlan(slist)
+    assert ScanPlan(slist, compress=True).chunks == [(0, 1)]
+
+
+def test_awgfile_clears_its_own_directory(tmp_path):
+    (tmp_path / 'old_1.wfm').write_bytes(b'old')
+    (tmp_path / 'old.seq').write_text('old')
+    (tmp_path / 'notes.txt').write_text('kept')
+    AWGFile(dirpath=tmp_path)
+    assert [p.name for p in tmp_path.iterdir()] == ['notes.txt']
+
+
+def test_seqcompile_writes_chunks(tmp_path):
+    from seqcompile import main
+    design = tmp_path / 'design.txt'
+    design.write_text('S2,1000,1000+t\nWave,1000,1000+t,Gauss\nGreen,1100+t,400000+t\nMeasure,1100+t,1400+t\n\n')
+    args = [str(design), '--scan', 'time', '--start', '100', '--stepsize', '10', '--steps', '12']
+    assert main(args + ['--dry-run']) == 0
+    assert not (tmp_path / 'out').exists()
+    assert main(args + ['--output', str(tmp_path / 'out')]) == 0
+    # 12 steps of 400000 points do not fit in the AWG at once
+    assert sorted(p.name for p in (tmp_path / 'out').iterdir()) == ['chunk1', 'chunk2']
+    lines = (tmp_path / 'out' / 'chunk2' / 'scan.seq').read_text().splitlines()
+    assert lines[1] == 'LINES 4' and lines[-2] == '"3_1.wfm","3_2.wfm",50000,1,0,0'
+
+
+def test_in_memory_files_match_disk(tmp_path):
+    from Hardware.AWG520.Sequence import SequenceList
+    seq = [['S2', '1000', '1400'], ['Wave', '1000', '1000+t', 'Sech'], ['Green', '1400', '3400']]
+    scanparams = {'type': 'time', 'start': 20, 'stepsize': 20, 'steps': 3}
+    pulseparams = {'amplitude': 100, 'pulsewidth': 10, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                   'skew phase': 0.0, 'num pulses': 1}
+    for compress in (False, True):
+        disk = tmp_path / 'disk{0}'.format(compress)
+        copy = tmp_path / 'copy{0}'.format(compress)
+        disk.mkdir()
+        copy.mkdir()
+        files = {}
+        for (name, dirpath, inmemory) in [('disk', disk, False), ('memory', None, True), ('copy', copy, True)]:
+            slist = SequenceList(seq, delay=[820, 10], pulseparams=dict(pulseparams), scanparams=scanparams)
+            f = AWGFile(sequencelist=slist, ftype='SEQ', dirpath=dirpath, compress=compress, inmemory=inmemory)
+            f.write_sequence()
+            files[name] = f.buffers
+        assert files['disk'] == {}
+        assert sorted(files['memory']) == sorted(p.name for p in disk.iterdir())
+        assert list(files['memory'])[-1] == 'scan.seq'
+        for (filename, buf) in files['memory'].items():
+            assert bytes(buf) == (disk / filename).read_bytes() == (copy / filename).read_bytes()
+    with pytest.raises(ValueError):
+        AWGFile(ftype='SEQ', dirpath=None, inmemory=True, workers=2)
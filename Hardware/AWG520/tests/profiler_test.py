@@ -0,0 +1,39 @@
+# tests for the profiler that times the stages of preparing an upload
+from Hardware.AWG520.Profiler import Profiler, profiler
+from Hardware.AWG520.Sequence import Sequence
+from Hardware.AWG520.AWG520 import AWGFile
+
+
+def test_profiler_off_records_nothing():
+    p = Profiler()
+    with p.span('write', 100) as span:
+        span.add_bytes(10)
+    assert p.summary() == []
+    p.enabled = True
+    with p.span('write', 100) as span:
+        span.add_bytes(10)
+    with p.span('parse'):
+        pass
+    summary = p.summary()
+    assert [stat['stage'] for stat in summary] == ['parse', 'write']
+    assert summary[1]['calls'] == 1 and summary[1]['bytes'] == 110
+    assert all(stat['wall_s'] >= 0 for stat in summary)
+
+
+def test_upload_stages_are_timed(tmp_path):
+    seq = [['S2', '1000', '1400'], ['Wave', '1000', '1400', 'Gauss'], ['Green', '1400', '3400'],
+           ['Measure', '1400', '1700']]
+    profiler.enabled = True
+    profiler.reset()
+    try:
+        s = Sequence(seq, delay=[820, 10])
+        s.create_sequence(dt=0)
+        f = AWGFile(dirpath=tmp_path)
+        f.write_waveform('1', 1, s.wavedata[0], s.c1markerdata)
+        stats = {stat['stage']: stat for stat in profiler.summary()}
+    finally:
+        profiler.enabled = False
+        profiler.reset()
+    assert list(stats) == ['parse', 'events', 'pulses', 'markers', 'encode', 'write']
+    assert stats['encode']['bytes'] == 5 * len(s.c1markerdata)
+    assert stats['write']['bytes'] == (tmp_path / '1_1.wfm').stat().st_size
@@ -0,0 +1,90 @@
+# tests for the pulse shapes and the caches used when generating them
+import numpy as np
+import pytest
+import os
+from Hardware.AWG520.Pulse import Gaussian, Square, LoadWave, EnvelopeCache, WaveFileCache, envelope_cache, \
+    wavefile_cache
+
+
+def test_envelope_cache_hits():
+    envelope_cache.clear()
+    first = Gaussian(1, 300, 0.01, 1.0, 0.0, 50, 100)
+    first.data_generator()
+    second = Gaussian(2, 300, 0.01, 1.0, 0.0, 50, 100)
+    second.data_generator()
+    assert (envelope_cache.hits, envelope_cache.misses) == (1, 1)
+    assert np.array_equal(first.I_data, second.I_data)
+    data = envelope_cache.get(('Gauss', 300, 50, first.amp), first.envelope)
+    assert data.dtype == np.float32
+    with pytest.raises(ValueError):
+        data[0] = 1.0  # the cached envelopes are read-only
+
+
+def test_envelope_cache_limits():
+    cache = EnvelopeCache(maxentries=2, maxbytes=1000)
+    for width in [10, 20, 30]:
+        cache.get(('Square', width, 0, 1.0), lambda: np.ones(width, dtype=np.float32))
+    assert list(cache.entries.keys()) == [('Square', 20, 0, 1.0), ('Square', 30, 0, 1.0)]
+    # 1000 bytes pushes out the other entries
+    cache.get(('Square', 250, 0, 1.0), lambda: np.ones(250, dtype=np.float32))
+    assert list(cache.entries.keys()) == [('Square', 250, 0, 1.0)]
+    cache.get(('Square', 500, 0, 1.0), lambda: np.ones(500, dtype=np.float32))  # too large to be stored at all
+    assert cache.nbytes == 1000 and cache.misses == 5
+
+
+def test_envelope_keeps_its_dtype(tmp_path):
+    # Square and LoadWave make float64 envelopes, which are multiplied by the carrier before the cast to float32
+    wavefile = tmp_path / 'wave.txt'
+    points = np.arange(100)
+    np.savetxt(str(wavefile), np.column_stack((points, points * 0.01, np.sin(points * np.pi / 100))), delimiter=',')
+    envelope_cache.clear()
+    phase = 2 * np.pi * (np.arange(333.0) * 0.0137 + 33.0 / 360.0)
+    for pulse in [Square(1, 333, 0.0137, 0.93, 33.0, 77), LoadWave(wavefile, 2, 333, 0.0137, 0.93, 33.0, 77, 10)]:
+        pulse.data_generator()
+        envelope = list(envelope_cache.entries.values())[-1]  # the entry just made for the pulse
+        assert envelope.dtype == np.float64
+        assert np.array_equal(pulse.I_data, np.array(envelope * np.cos(phase), dtype=np.float32))
+
+
+def test_carrier_follows_pulse_start():
+    pulse = Gaussian(1, 300, 0.013, 1.0, 30.0, 50, 100)
+    pulse.start = 1000
+    pulse.data_generator()
+    phase = 2 * np.pi * ((np.arange(300) + 1000) * 0.013 + 30.0 / 360.0)
+    assert np.array_equal(pulse.I_data, np.array(pulse.envelope() * np.cos(phase), dtype=np.float32))
+
+
+def write_wave_file(path, npoints=500, scale=1.0):
+    with open(path, 'w') as f:
+        for i in range(npoints):
+            f.write('{0}, {1}, {2} \n'.format(i, i * 0.01, scale * np.sin(i * np.pi / npoints)))
+
+
+def test_wave_file_cache(tmp_path):
+    wavefile = tmp_path / 'wave.txt'
+    write_wave_file(wavefile)
+    envelope_cache.clear()
+    wavefile_cache.clear()
+    pulse = LoadWave(wavefile, 1, 300, 0.01, 1.0, 0.0, 100, 10)
+    pulse.data_generator()
+    # the same as reading and resampling the file directly
+    csv = np.genfromtxt(str(wavefile), delimiter=',')
+    tt = np.array(csv[:, 1], dtype=np.float32)
+    data = np.array(csv[:, 2], dtype=np.float32)
+    resampleidx = np.linspace(tt[0], tt[-1], 300)
+    expected = np.interp(resampleidx, tt, data) * pulse.amp / np.amax(data)
+    assert np.array_equal(pulse.cached_envelope(), expected)
+    # a pulse of another width resamples the file again but does not parse it again
+    LoadWave(wavefile, 2, 200, 0.01, 1.0, 0.0, 100, 10).data_generator()
+    assert wavefile_cache.parses == 1
+    # a new session reads the sidecar instead of parsing the file
+    assert os.path.exists(str(wavefile) + '.npy')
+    cache = WaveFileCache()
+    assert all(np.array_equal(a, b) for (a, b) in zip(cache.load(wavefile), (tt, data)))
+    assert cache.parses == 0
+    # changing the file changes its size, so it is parsed again and the new envelope is used
+    write_wave_file(wavefile, npoints=400, scale=0.5)
+    changed = LoadWave(wavefile, 3, 300, 0.01, 1.0, 0.0, 100, 10)
+    changed.data_generator()
+    assert wavefile_cache.parses == 2
+    assert not np.array_equal(changed.I_data, pulse.I_data)
@@ -2,8 +2,9 @@
 from pathlib import Path
 import numpy as np
 import matplotlib.pyplot as plt
-from Hardware.AWG520.Sequence import Sequence,SequenceList
-#import pytest
+from Hardware.AWG520.Sequence import Sequence,SequenceList,SequenceTiming,compile_timing_expression,\
+    increment_sequence_by_dt,EventTable,paint_marker
+import pytest
 
 print('Module name is: ',__name__)
 def make_seq():
@@ -55,9 +56,157 @@ def make_seq_list():
 def test_sequence():
     make_seq()
 
+def test_timing_expressions():
+    assert compile_timing_expression('2000+t') == (2000, 1)
+    assert compile_timing_expression(' 1000') == (1000, 0)
+    assert compile_timing_expression('1000+3t') == (1000, 3)
+    assert compile_timing_expression('1000+2t-t-500') == (500, 1)
+    assert compile_timing_expression(' 1000 + 3 t ') == (1000, 3)
+    with pytest.raises(ValueError):
+        compile_timing_expression('1000+x')
+    with pytest.raises(ValueError):
+        compile_timing_expression('10 00+t')
+
+def test_timing_scan():
+    seq = [['Wave', '1000', '1500+t', 'Gauss'], ['Green', '1500+2t', '2500+2t'], ['Measure', '3000-t', '3100']]
+    timing = SequenceTiming(seq)
+    steptimes = timing.evaluate_scan([0, 10, 20])
+    for (idx, dt) in enumerate([0, 10, 20]):
+        assert timing.resolve(seq, steptimes[idx]) == increment_sequence_by_dt(seq, dt)
+    assert increment_sequence_by_dt(seq, 10) == [['Wave', '1000', '1510', 'Gauss'], ['Green', '1520', '2520'],
+                                                 ['Measure', '2990', '3100']]
+
+def test_event_table():
+    seq = [['Green', '2000', '3000'], ['Wave', '1000', '1010', 'Gauss'], ['Measure', '2000', '2100'],
+           ['Green', '0', '500']]
+    table = EventTable(seq)
+    assert table.to_dict() == {'Green': [(0, 500, 500, ''), (2000, 3000, 1000, '')],
+                               'Wave': [(1000, 1010, 10, 'Gauss')], 'Measure': [(2000, 2100, 100, '')]}
+    table.fix_minimum_duration(channel='Wave', deviation=10)
+    assert table.to_dict()['Wave'] == [(1000, 1060, 60, 'Gauss')]
+    table.insert_pulse_train(channel='Wave', duration=60, n=2)
+    assert table.to_dict()['Wave'] == [(1000, 1060, 60, 'Gauss'), (1060, 1120, 60, 'Gauss'),
+                                       (1120, 1180, 60, 'Gauss')]
+    assert table.max_event() == 3120
+
+def test_pulse_train_scheduler():
+    seq = [['Wave', '1000', '1060', 'Gauss'], ['S2', '1000', '1060'], ['Measure', '1100', '1200'],
+           ['Green', '2000', '3000'], ['Wave', '2500', '2560', 'Gauss']]
+    table = EventTable(seq)
+    table.insert_pulse_train(channel='Wave', duration=60, n=2)
+    events = table.to_dict()
+    # both pulses are now trains of 3, and everything after the start of a train moves by 120 per train
+    assert [e[:2] for e in events['Wave']] == [(1000, 1060), (1060, 1120), (1120, 1180), (2620, 2680),
+                                                (2680, 2740), (2740, 2800)]
+    assert events['S2'] == [(1000, 1060, 60, '')]
+    assert events['Measure'] == [(1220, 1320, 100, '')]
+    assert events['Green'] == [(2120, 3120, 1000, '')]
+
+def test_carrier_phase_is_continuous():
+    params = {'amplitude': 100, 'pulsewidth': 10, 'SB freq': 0.013, 'IQ scale factor': 0.9, 'phase': 30.0,
+              'skew phase': 5.0, 'num pulses': 1}
+    split = Sequence([['Wave', '100', '300', 'Square'], ['Wave', '300', '500', 'Square']], pulseparams=params)
+    split.create_sequence()
+    whole = Sequence([['Wave', '100', '500', 'Square']], pulseparams=params)
+    whole.create_sequence()
+    assert np.array_equal(split.wavedata, whole.wavedata)
+
+def test_paint_marker():
+    markers = np.zeros(20, dtype=np.int8)
+    paint_marker(markers, 5, 10, 1)
+    paint_marker(markers, 8, 12, 1)  # overlapping events on the same marker don't spill into the other bit
+    paint_marker(markers, 2, 6, 2, delay=4)  # the part moved before sample 0 wraps around to the end
+    expected = np.zeros(20, dtype=np.int8)
+    expected[5:12] = 1
+    expected[0:2] += 2
+    expected[18:20] += 2
+    assert np.array_equal(markers, expected)
+    # same as moving a full length marker array with np.roll
+    single = np.zeros(20, dtype=np.int8)
+    paint_marker(single, 3, 30, 2, delay=7)
+    reference = np.zeros(20, dtype=np.int8)
+    reference[3:30] = 2
+    assert np.array_equal(single, np.roll(reference, -7))
+
+def test_unconnected_marker():
+    # S2 is not connected to a marker, so its events set no marker bits, the same as the Marker pulses used to
+    connections = {'S1': None, 'S2': None, 'Green': 2, 'Measure': 4}
+    s = Sequence([['S2', '100', '200'], ['Green', '0', '100'], ['Measure', '200', '300']], connectiondict=connections)
+    s.create_sequence()
+    expected = np.zeros(s.maxend, dtype=np.int8)
+    expected[0:100] = 2
+    assert np.array_equal(s.c1markerdata, expected)
+    expected[:] = 0
+    expected[200:300] = 2
+    assert np.array_equal(s.c2markerdata, expected)
+
 def test_seq_list():
     make_seq_list()
 
+def test_parallel_seq_list():
+    seq = [['S2', '1000', '1300'], ['Wave', '1000', '1000+t', 'Sech'], ['Green', '1000+t', '2000+t']]
+    scanparams = {'type': 'time', 'start': 10, 'stepsize': 40, 'steps': 4}
+    newparams = {'amplitude': 100, 'pulsewidth': 50, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                 'skew phase': 0.0, 'num pulses': 1}
+    serial = SequenceList(seq, delay=[820, 10], scanparams=scanparams, pulseparams=dict(newparams))
+    serial.create_sequence_list()
+    parallel = SequenceList(seq, delay=[820, 10], scanparams=scanparams, pulseparams=dict(newparams))
+    parallel.create_sequence_list(workers=2)
+    assert len(parallel.sequencelist) == len(serial.sequencelist)
+    for (s, p) in zip(serial.sequencelist, parallel.sequencelist):
+        assert np.array_equal(s.wavedata, p.wavedata)
+        assert np.array_equal(s.c1markerdata, p.c1markerdata)
+        assert np.array_equal(s.c2markerdata, p.c2markerdata)
+
+def test_delta_seq_list():
+    seq = [['S2', '1000', '1300'], ['Wave', '1000', '1000+t', 'Gauss'], ['Green', '1400', '2400'],
+           ['Measure', '1400', '1700']]
+    newparams = {'amplitude': 100, 'pulsewidth': 50, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                 'skew phase': 0.0, 'num pulses': 2}
+    for scantype in ['amplitude', 'SB freq', 'pulsewidth', 'time', 'number']:
+        scanparams = {'type': scantype, 'start': 20, 'stepsize': 10, 'steps': 3}
+        # the crosscheck compiles every derived step in full as well and raises if the data differs
+        slist = SequenceList(seq, delay=[820, 10], scanparams=scanparams, pulseparams=dict(newparams))
+        slist.create_sequence_list(crosscheck=True)
+        assert len(slist.sequencelist) == 3
+    # an amplitude scan only changes the waves, so the markers of every step are the ones of the first step
+    scanparams = {'type': 'amplitude', 'start': 20, 'stepsize': 10, 'steps': 3}
+    slist = SequenceList(seq, delay=[820, 10], scanparams=scanparams, pulseparams=dict(newparams))
+    slist.create_sequence_list()
+    base = slist.sequencelist[0]
+    for s in slist.sequencelist[1:]:
+        assert s.c1markerdata is base.c1markerdata and s.c2markerdata is base.c2markerdata
+        assert not np.array_equal(s.wavedata, base.wavedata)
+
+def test_batch_seq_list():
+    seq = [['S2', '1000', '1300'], ['Wave', '1000', '1200', 'Gauss'], ['Wave', '1300', '1400', 'Square'],
+           ['Green', '1400', '2400'], ['Measure', '1400', '1700']]
+    newparams = {'amplitude': 100, 'pulsewidth': 10, 'SB freq': 0.01, 'IQ scale factor': 1.0, 'phase': 0.0,
+                 'skew phase': 0.0, 'num pulses': 1}
+    for (scantype, start, stepsize) in [('amplitude', 50, 50), ('SB freq', 0.01, 0.005), ('pulsewidth', 10, 2)]:
+        scanparams = {'type': scantype, 'start': start, 'stepsize': stepsize, 'steps': 4}
+        # the crosscheck compiles every step in full as well and raises if the data differs
+        slist = SequenceList(seq, delay=[820, 10], scanparams=scanparams, pulseparams=dict(newparams))
+        slist.create_sequence_list(crosscheck=True)
+        assert len(slist.sequencelist) == 4
+        # the waves of all the steps are made as one array
+        base = slist.sequencelist[0].wavedata.base
+        assert base is not None and base.shape == (4, 2, slist.sequencelist[0].maxend)
+        assert all(s.wavedata.base is base for s in slist.sequencelist)
+
+
+def test_import_is_headless(tmp_path):
+    import os, subprocess, sys
+    # a fresh interpreter in an empty directory, like a worker process or a command line tool
+    root = Path(__file__).resolve().parents[3]
+    script = ('import sys, Hardware.AWG520.Sequence, Hardware.AWG520.AWG520\n'
+              'print([m for m in ("matplotlib", "PyQt5", "ADwin") if m in sys.modules])')
+    out = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, capture_output=True, text=True, check=True,
+                         env=dict(os.environ, PYTHONPATH=str(root), PYTHONDONTWRITEBYTECODE='1'))
+    assert out.stdout.strip() == '[]'
+    assert list(tmp_path.iterdir()) == []
+
+
 if __name__ == '__main__':
     #test_sequence()
     test_seq_list()
\ No newline at end of file
@@ -0,0 +1,46 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import logging
+
+
+class LazyFileHandler(logging.FileHandler):
+    def __init__(self, filename, mode='a', encoding=None):
+        """File handler that opens its log file, and makes the directory of the file if needed, only when the first
+        record is written, so that importing a module that logs to a file does not touch the filesystem."""
+        super().__init__(filename, mode=mode, encoding=encoding, delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+def add_log_handlers(logger, filename):
+    """sets the logger to the DEBUG level and adds the handlers used by all the hardware modules: a file handler on
+    filename that logs even debug messages, and a console handler that only logs errors"""
+    logger.setLevel(logging.DEBUG)
+    # create a file handler that logs even debug messages
+    fh = LazyFileHandler(filename)
+    fh.setLevel(logging.DEBUG)
+    # create a console handler with a higher log level
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.ERROR)
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(formatter)
+    ch.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(fh)
+    logger.addHandler(ch)
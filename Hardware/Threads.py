@@ -18,15 +18,16 @@
 
 from PyQt5 import QtCore
 from Hardware.AWG520 import AWG520
+from Hardware.AWG520.AWG520 import AWGFile, ScanPlan
 from Hardware.AWG520.Sequence import Sequence,SequenceList
-from Hardware.PTS3200 import PTS
-from Hardware.MCL.NanoDrive import MCL_NanoDrive
+from Hardware.AWG520.Profiler import profiler
+from Hardware.LogFiles import add_log_handlers
 
-import time,sys,numpy,multiprocessing
+import time,sys,numpy,multiprocessing,copy
 import logging
 
 
-import ADwin,os
+import os
 
 from pathlib import Path
 
@@ -34,23 +35,40 @@ hwdir  = Path('.')
 dirPath = hwdir / 'AWG520/sequencefiles/'
 
 modlogger = logging.getLogger('threadlogger')
-modlogger.setLevel(logging.DEBUG)
-# create a file handler that logs even debug messages
-fh = logging.FileHandler('./logs/threadlog.log')
-fh.setLevel(logging.DEBUG)
-# create a console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.ERROR)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-ch.setFormatter(formatter)
-# add the handlers to the logger
-modlogger.addHandler(fh)
-modlogger.addHandler(ch)
+# the log file is only opened when the first message is logged
+add_log_handlers(modlogger, './logs/threadlog.log')
 
 _GHZ = 1000000000
 _MHZ = 1000000
+
+def upload_sequence_list(awgcomm, sequences, timeres, samples, keepdir=None):
+    """encodes the files of the sequence list in memory, transfers all of them to the AWG and returns the seq file
+    line of each step. If keepdir is not None a copy of the files is also written there."""
+    awgfile = AWGFile(sequencelist=sequences, ftype='SEQ', timeres=timeres, dirpath=keepdir, inmemory=True)
+    awgfile.write_sequence(repeat=samples)
+    t = time.perf_counter()
+    # only the files that changed since the last upload go through the FTP session, straight from their buffers, and
+    # the wfm files left over from earlier scans are removed from the AWG. The seq file is the last one written
+    if awgcomm.syncfiles(list(awgfile.buffers.items())) < 0:
+        modlogger.error('could not transfer all the files to the AWG')
+        raise RuntimeError('could not transfer all the files to the AWG')
+    transfer_time = time.perf_counter() - t
+    modlogger.info('time elapsed for all files to be transferred is:{0:f}'.format(transfer_time))
+    return awgfile.steplines
+
+def chunks_for_process(chunks):
+    """returns the chunks of a scan to pass to the scan process. A scan of one chunk was uploaded in full by the
+    upload thread, so None is returned. Otherwise the compiled steps are left out of each chunk, so that they are not
+    pickled into the process, and load_chunk compiles the chunk again when the scan reaches it."""
+    if not chunks or len(chunks) == 1:
+        return None
+    bare = []
+    for sequences in chunks:
+        sequences = copy.copy(sequences)
+        sequences.sequencelist = []
+        bare.append(sequences)
+    return bare
+
 class UploadThread(QtCore.QThread):
     """this is the upload thread. it has following variables:
     1. seq = the sequence list of strings
@@ -61,11 +79,16 @@ class UploadThread(QtCore.QThread):
     6. mwparams = mw params dict
     7. timeRes = awg clock rate in ns
 
-    This class emits one Pyqtsignal
+    This class emits three Pyqtsignals
     1. done  - when the upload is finished
+    2. timing - with the time taken by each stage of the upload on one line, when profile is True
+    3. failed - with the error message, when the scan does not fit in the AWG or the upload fails
+
+    Setting profile to False before the thread is started switches off the timing of the stages.
     """
-    # this method only has one signal done
     done=QtCore.pyqtSignal()
+    timing=QtCore.pyqtSignal(str)
+    failed=QtCore.pyqtSignal(str)
     def __init__(self,parent=None,seq = None,scan = None,params = None,awgparams = None,pulseparams = None,
                  mwparams = None, timeRes = 1):
         #super().__init__(self)
@@ -94,8 +117,12 @@ class UploadThread(QtCore.QThread):
             self.parameters = [50000, 300, 1000, 10, 50, 820, 10]
                                 # should make into dictionary with keys 'sample', 'count time',
                                 # 'reset time', 'avg', 'threshold', 'AOM delay', 'microwave delay'
+        self.chunks = None
+        self.profile = True
 
     def run(self):
+        profiler.enabled = self.profile
+        profiler.reset()
         # create files
         samples = self.parameters[0]
         delay = self.parameters[-2:]
@@ -108,33 +135,47 @@ class UploadThread(QtCore.QThread):
             #self.scan['type'] = 'frequency'
             self.scan['type'] = 'no scan' # this tells the SeqList class to simply put one sequence as the PTS will
             # scan the frequency
-        # now create teh sequences
-        self.sequences = SequenceList(sequence=self.seq,delay=delay,pulseparams = self.pulseparams,scanparams = self.scan,
-                                      timeres=self.timeRes)
-        # write the files to the AWG520/sequencefiles directory
-        self.awgfile = AWGFile(sequencelist  = self.sequences,ftype='SEQ',timeres = self.timeRes)
-        self.awgfile.write_sequence(repeat = samples)
-        # now upload the files
+        self.chunks = None
+        self.awgcomm = None
         try:
-            if self.awgparamgs['device'] == 'awg520':
-                self.awgcomm = AWG520()
-                self.awgcomm.setup(do_enable_iq) # pass the enable IQ flag otherwise the AWG will only use one channel
-                #  transfer all files to AWG
-                t = time.process_time()
-                for filename in os.listdir(dirPath):
-                    self.awgcomm.sendfile(filename, filename)
-                transfer_time = time.process_time() - t
-                time.sleep(1)
-                modlogger.info('time elapsed for all files to be transferred is:{0:d}'.format(transfer_time))
-                self.awgcomm.cleanup()
-                self.done.emit()
-            else:
-                raise ValueError('AWG520 is the only AWG supported')
-        except ValueError:
-            modlogger.error('AWG520 is only AWG supported')
-            raise
+            if self.awgparams['awg device'] != 'awg520':
+                modlogger.error('AWG520 is only AWG supported')
+                self.failed.emit('AWG520 is the only AWG supported')
+                return
+            # now create teh sequences
+            self.sequences = SequenceList(sequence=self.seq,delay=delay,pulseparams = self.pulseparams,
+                                          scanparams = self.scan,timeres=self.timeRes)
+            # check the scan against the AWG memory before anything is compiled, a scan that is too large is split
+            # into chunks, and the scan process uploads the chunks after the first one as it reaches them
+            self.plan = ScanPlan(self.sequences)
+            chunks = self.plan.chunk_sequences()
+            # now write the files of the first chunk and upload them
+            self.awgcomm = AWG520()
+            # pass the enable IQ flag otherwise the AWG will only use one channel
+            if not self.awgcomm.setup(do_enable_iq):
+                raise RuntimeError('AWG setup failed, see the awg520private log')
+            #  transfer all files to AWG
+            upload_sequence_list(self.awgcomm, chunks[0], self.timeRes, samples)
+            if self.profile:
+                modlogger.info('time taken by each stage of the upload:\n' + profiler.report())
+                self.timing.emit(profiler.short_report())
+            time.sleep(1)
+        except ValueError as err:
+            # the scan does not fit in the AWG, or the sequence or its params are not valid
+            modlogger.error('Upload failed: {0}'.format(err))
+            self.failed.emit('Upload failed: {0}'.format(err))
+            return
         except RuntimeError as err:
-            modlogger.error('Run time error'.format(err))
+            modlogger.error('Run time error {0}'.format(err))
+            self.failed.emit('Upload failed: {0}'.format(err))
+            return
+        finally:
+            # close the connections to the AWG even if the upload failed, so that they are not left open for the scan
+            if self.awgcomm is not None:
+                self.awgcomm.cleanup()
+        # the scan thread only gets the chunks of an upload that went through
+        self.chunks = chunks
+        self.done.emit()
 
 
 
@@ -184,6 +225,7 @@ class ScanThread(QtCore.QThread):
             self.parameters = [50000, 300, 1000, 10, 50, 820, 10]
             # should make into dictionary with keys 'sample', 'count time',
             # 'reset time', 'avg', 'threshold', 'AOM delay', 'microwave delay'
+        self.chunks = None # the sequence list of each chunk of the scan, from the upload thread
 
     def run(self):
         self.scanning=True
@@ -201,6 +243,8 @@ class ScanThread(QtCore.QThread):
         self.proc.scan=self.scan
         # pass the awg info
         self.proc.awg = self.awg
+        # pass the chunks of a scan that is too large to upload at once
+        self.proc.chunks = chunks_for_process(self.chunks)
         # keep track of the maxcounts
         self.maxcounts = maxcounts
         self.proc.maxcounts=self.maxcounts
@@ -257,6 +301,10 @@ class ScanProcess(multiprocessing.Process):
             # 'reset time', 'avg', 'threshold', 'AOM delay', 'microwave delay'
         self.conn = conn
         self.scanning = False
+        self.chunks = None # the sequence list of each chunk, if the scan is too large for the AWG
+        self.chunk = 0 # the first chunk is uploaded by the upload thread
+        self.steplines = None
+        self.awgready = False # set by initialize once the AWG is set up
         self.initialize()
 
 
@@ -279,6 +327,9 @@ class ScanProcess(multiprocessing.Process):
         num_freq_steps = self.mw['PTS'][5]
         stop_freq = self.mw['PTS'][6]
         do_enable_iq = self.awgparams['enable IQ']
+        # the vendor libraries are only imported in the scan process, which is the only place they are used
+        import ADwin
+        from Hardware.PTS3200 import PTS
         self.adw = ADwin.ADwin()
         try:
             # boot the adwin with the bootloader
@@ -306,7 +357,14 @@ class ScanProcess(multiprocessing.Process):
             self.scanning = False
 
         self.awgcomm = AWG520()
-        self.awgcomm.setup(do_enable_iq) # why are we setting up the AWG again? it should have been done already by Upload thread
+        # why are we setting up the AWG again? it should have been done already by Upload thread
+        if not self.awgcomm.setup(do_enable_iq):
+            modlogger.error('AWG setup failed, aborting the scan')
+            self.awgcomm.cleanup()
+            self.conn.send('Abort!')
+            self.scanning = False
+            return
+        self.awgready = True
 
         self.awgcomm.run()  # why are we running the sequence once? so that we can wait for the trigger?
         time.sleep(0.2)
@@ -318,6 +376,9 @@ class ScanProcess(multiprocessing.Process):
             modlogger.error('No microwave synthesizer selected')
 
     def run(self):
+        if not self.awgready:
+            # initialize could not set up the AWG and has already told the scan thread to abort
+            return
         self.scanning=True
         #self.initialize() # why is initialize called in run? it would seem best to initialize hardware first
         numavgs = self.parameters[3]
@@ -381,6 +442,10 @@ class ScanProcess(multiprocessing.Process):
                     self.parameters[4],self.scanning = self.conn.recv() # receive the threshold and scanning status
         except Abort:
             self.conn.send('Abort!')
+        except RuntimeError as err:
+            # the upload or setup of a chunk of the scan failed
+            modlogger.error('Scan aborted: {0}'.format(err))
+            self.conn.send('Abort!')
             
         self.cleanup()
         
@@ -391,8 +456,9 @@ class ScanProcess(multiprocessing.Process):
         flag=self.adw.Get_Par(10)
         modlogger.info('Adwin Par_10 is {0:d}'.format(flag))
         
-        if x==0 or args!=():
-            self.awgcomm.jump(x+2) # we jump over the first 2 points in the scan?
+        line, loaded = self.step_line(x)
+        if x==0 or loaded or args!=():
+            self.awgcomm.jump(line) # we jump over the first 2 points in the scan?
             time.sleep(0.005)  # This delay is necessary. Otherwise neither jump nor trigger would be recognized by awg.
 
         self.awgcomm.trigger()
@@ -410,6 +476,34 @@ class ScanProcess(multiprocessing.Process):
         ref=self.adw.Get_Par(2)
         return sig,ref
     
+    def step_line(self, x):
+        """returns the seq file line of scan point x, and whether the chunk of the scan with the point had to be
+        uploaded first because the scan is too large for the AWG"""
+        if not self.chunks or len(self.chunks) == 1:
+            return (x + 2, False)
+        first = 0
+        for (chunk, sequences) in enumerate(self.chunks):
+            if x < first + len(sequences.scanlist):
+                break
+            first += len(sequences.scanlist)
+        if chunk != self.chunk:
+            self.load_chunk(chunk)
+            return (self.steplines[x - first], True)
+        return (self.steplines[x - first] if self.steplines else x - first + 2, False)
+
+    def load_chunk(self, chunk):
+        """writes and uploads the files of a chunk of the scan and starts its sequence on the AWG"""
+        modlogger.info('uploading chunk {0:d} of {1:d}'.format(chunk + 1, len(self.chunks)))
+        self.awgcomm.stop()
+        self.steplines = upload_sequence_list(self.awgcomm, self.chunks[chunk], self.timeRes, self.parameters[0])
+        if not self.awgcomm.setup(self.awgparams['enable IQ']):
+            raise RuntimeError('AWG setup failed after uploading chunk {0:d}'.format(chunk + 1))
+        self.awgcomm.run()
+        time.sleep(0.2)
+        self.awgcomm.trigger()
+        time.sleep(0.1)
+        self.chunk = chunk
+
     def track(self):
         self.axis='z'
         position = self.nd.SingleReadN(self.axis, self.handle)
@@ -422,6 +516,7 @@ class ScanProcess(multiprocessing.Process):
         time.sleep(0.005)  # This delay is necessary. Otherwise neither jump nor trigger would be recognized by awg.
         self.awgcomm.trigger()
 
+        from Hardware.MCL.NanoDrive import MCL_NanoDrive
         self.nd=MCL_NanoDrive()
         self.handle=self.nd.InitHandles()['L']
         self.accuracy=0.025
@@ -537,6 +632,8 @@ class KeepProcess(multiprocessing.Process):
         self.cleanup()
         
     def initialize(self):
+        import ADwin
+        from Hardware.MCL.NanoDrive import MCL_NanoDrive
         self.nd=MCL_NanoDrive()
         self.adw=ADwin.ADwin()
         try:
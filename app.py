@@ -242,6 +242,8 @@ class appGUI(QtWidgets.QMainWindow):
         '''This function creates all the threads needed to carry out I/O with hardware. '''
         self.uThread = UploadThread()
         self.uThread.done.connect(self.uploadDone)
+        self.uThread.timing.connect(self.ui.statusbar.showMessage)
+        self.uThread.failed.connect(self.uploadFailed)
         self.sThread = ScanThread()
         self.sThread.data.connect(self.dataBack)
         self.sThread.tracking.connect(self.trackingBack)
@@ -473,6 +475,11 @@ class appGUI(QtWidgets.QMainWindow):
     def uploadDone(self):
         self.ui.pushButtonUpload.setEnabled(True)
         self.ui.pushButtonStart.setEnabled(True)
+
+    def uploadFailed(self, s):
+        # nothing was uploaded, so only allow another upload
+        self.ui.statusbar.showMessage(s)
+        self.ui.pushButtonUpload.setEnabled(True)
     # end upload functions    
     # begin KeepNV  functions
     # def standby(self):
@@ -545,6 +552,7 @@ class appGUI(QtWidgets.QMainWindow):
         self.sThread.awgparams = self.awgparams
         self.sThread.pulseparams = self.pulseparams
         self.sThread.maxcounts = self.maxcounts
+        self.sThread.chunks = self.uThread.chunks
         self.ui.pushButtonStart.setEnabled(False)
         self.ui.pushButtonUpload.setEnabled(False)
         self.ui.checkBoxAutoSave.setEnabled(False)
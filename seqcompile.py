@@ -0,0 +1,121 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Compiles a sequence design from SeqDesigns into the wfm and seq files of the AWG520 without the GUI, e.g.
+    python seqcompile.py SeqDesigns/simple.txt --scan time --start 0 --stepsize 10 --steps 100 --output rabi
+A scan that is too large for the AWG memory is written as one subdirectory per chunk, chunk1, chunk2 and so on, which
+are uploaded one after another. Use --dry-run to only print the size of the scan and --timing for the time taken by
+each stage.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from Hardware.AWG520.AWG520 import AWGFile, ScanPlan, _WFMTYPE
+from Hardware.AWG520.Sequence import SequenceList
+from Hardware.AWG520.Profiler import profiler
+
+_SCAN_TYPES = ['no scan', 'amplitude', 'time', 'SB freq', 'pulsewidth', 'number']
+_MB = 1048576
+
+
+def read_seq_file(filename):
+    """returns the sequence in a SeqDesigns file as a list of [type, start, stop, optional params] lists, the same as
+    the sequence text box of the GUI makes. Blank lines are skipped."""
+    with open(filename) as f:
+        return [[field.strip() for field in line.split(',')] for line in f if line.strip()]
+
+
+def number(text):
+    """converts a scan start or step size to an int if it is a whole number, so that time scans stay on the clock"""
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Compile a sequence design into AWG520 wfm and seq files')
+    parser.add_argument('seqfile', help='sequence design, one line of type,start,stop[,params] per pulse')
+    parser.add_argument('--output', type=Path, help='directory the files are written to, it is made if needed')
+    parser.add_argument('--scan', choices=_SCAN_TYPES, default='no scan', help='type of scan')
+    parser.add_argument('--start', type=number, default=0, help='first value of the scan')
+    parser.add_argument('--stepsize', type=number, default=1, help='step size of the scan')
+    parser.add_argument('--steps', type=int, default=1, help='number of steps in the scan')
+    parser.add_argument('--amplitude', type=float, default=100, help='pulse amplitude, 0 to 100')
+    parser.add_argument('--pulsewidth', type=int, default=20, help='pulse width in ns')
+    parser.add_argument('--sb-freq', type=float, default=0.0, help='SSB frequency in GHz')
+    parser.add_argument('--iq-scale', type=float, default=1.0, help='IQ scale factor')
+    parser.add_argument('--phase', type=float, default=0.0, help='phase in degrees')
+    parser.add_argument('--skew-phase', type=float, default=0.0, help='skew phase in degrees')
+    parser.add_argument('--num-pulses', type=int, default=1, help='number of pulses')
+    parser.add_argument('--delay', type=int, nargs=2, default=[820, 10], metavar=('AOM', 'MW'),
+                        help='AOM and microwave delays in ns')
+    parser.add_argument('--timeres', type=int, default=1, help='AWG clock rate in ns')
+    parser.add_argument('--repeat', type=int, default=50000, help='repetitions of each step, i.e. the samples')
+    parser.add_argument('--workers', type=int, help='number of processes used to compile and write the steps')
+    parser.add_argument('--compress', action='store_true', help='store runs of identical data once, see AWGFile')
+    parser.add_argument('--dry-run', action='store_true', help='only print the size of the scan, write nothing')
+    parser.add_argument('--timing', action='store_true', help='print the time taken by each stage')
+    return parser
+
+
+def make_sequence_list(args):
+    pulseparams = {'amplitude': args.amplitude, 'pulsewidth': args.pulsewidth, 'SB freq': args.sb_freq,
+                   'IQ scale factor': args.iq_scale, 'phase': args.phase, 'skew phase': args.skew_phase,
+                   'num pulses': args.num_pulses}
+    scanparams = {'type': args.scan, 'start': args.start, 'stepsize': args.stepsize, 'steps': args.steps}
+    return SequenceList(read_seq_file(args.seqfile), delay=list(args.delay), scanparams=scanparams,
+                        pulseparams=pulseparams, timeres=args.timeres)
+
+
+def print_plan(plan):
+    """prints the points, file sizes and seq file lines the scan will need, chunk by chunk"""
+    lengths = plan.steplengths
+    print('{0} steps of {1} to {2} points, {3} chunk(s)'.format(len(lengths), min(lengths), max(lengths),
+                                                               len(plan.chunks)))
+    for (num, (first, stop)) in enumerate(plan.chunks, 1):
+        (points, lines) = plan.blank_cost(first)
+        points += sum(cost[0] for cost in plan.stepcosts[first:stop])
+        lines += sum(cost[1] for cost in plan.stepcosts[first:stop])
+        print('chunk {0}: steps {1} to {2}, at most {3} points and {4:.1f} MB of wfm files per channel, {5} seq file '
+              'lines'.format(num, first + 1, stop, points, points * _WFMTYPE.itemsize / _MB, lines))
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    if args.output is None and not args.dry_run:
+        print('--output is needed unless --dry-run is given', file=sys.stderr)
+        return 2
+    profiler.enabled = args.timing
+    t = time.perf_counter()
+    sequences = make_sequence_list(args)
+    plan = ScanPlan(sequences, compress=args.compress)
+    print_plan(plan)
+    if not args.dry_run:
+        chunks = plan.chunk_sequences()
+        for (num, chunk) in enumerate(chunks, 1):
+            chunkdir = args.output / 'chunk{0}'.format(num) if len(chunks) > 1 else args.output
+            chunkdir.mkdir(parents=True, exist_ok=True)
+            awgfile = AWGFile(sequencelist=chunk, ftype='SEQ', timeres=args.timeres, dirpath=chunkdir,
+                              workers=args.workers, compress=args.compress)
+            awgfile.write_sequence(repeat=args.repeat)
+            print('wrote {0} wfm files and the seq file to {1}'.format(len(awgfile.wfmfiles), chunkdir))
+    if args.timing:
+        print(profiler.report())
+        print('total {0:.3f} s'.format(time.perf_counter() - t))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())